@@ -1,10 +1,24 @@
 import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+import time
 import uuid
 import asyncio
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
 import httpx
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from job_store import create_job_store
 
 app = FastAPI()
 
@@ -22,8 +36,43 @@ WORKER_URL = os.environ.get("WORKER_URL", "http://localhost:8001")
 UPLOADS_DIR = "worker_uploads"
 RESULTS_DIR = "worker_results"
 
-# In-memory dictionary to act as a simple database for job tracking
-JOBS = {}
+# Read size when hashing saved uploads, and the chunk size suggested to resumable-upload clients.
+# Streamed multipart bodies are written in whatever pieces request.stream() delivers.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 1 MiB
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 2 * 1024 * 1024 * 1024))  # 2 GiB
+# Non-file form fields (e.g. the JSON options) are small; anything larger is rejected
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+# Resumable uploads keep their partial data and metadata next to regular uploads in UPLOADS_DIR
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", 24 * 60 * 60))
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+# Job tracking. "sqlite" persists jobs across restarts and shares them between orchestrator
+# processes; "memory" keeps them in a per-process dict.
+JOB_STORE = os.environ.get("JOB_STORE", "sqlite")
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", "jobs.db")
+# Jobs still processing after this long are considered lost (e.g. the worker crashed)
+JOB_TIMEOUT_SECONDS = int(os.environ.get("JOB_TIMEOUT_SECONDS", 60 * 60))
+# Downloaded jobs leave a tombstone with their options and lineage so they can still be
+# re-meshed; tombstones older than this are dropped
+DOWNLOADED_JOB_TTL_SECONDS = int(os.environ.get("DOWNLOADED_JOB_TTL_SECONDS", 7 * 24 * 60 * 60))
+# How often running orchestrators apply the two limits above
+JOB_SWEEP_INTERVAL_SECONDS = int(os.environ.get("JOB_SWEEP_INTERVAL_SECONDS", 60))
+
+JOBS = create_job_store(JOB_STORE, JOB_STORE_PATH)
+
+# Content-addressed result cache: results are kept under a key derived from the video's SHA-256,
+# the effective job options, the worker's config version and the model version, so re-uploading
+# the same clip is served instantly.
+# Least recently used results are evicted beyond RESULT_CACHE_MAX_BYTES.
+RESULT_CACHE_DIR = os.path.join(RESULTS_DIR, "cache")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))  # 5 GiB
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "VGGT-1B")
+
+# How often and how long to retry when the worker answers 429/503 (queue full or not ready)
+WORKER_MAX_RETRIES = int(os.environ.get("WORKER_MAX_RETRIES", 20))
+WORKER_RETRY_DELAY_SECONDS = int(os.environ.get("WORKER_RETRY_DELAY_SECONDS", 15))
+WORKER_MAX_RETRY_DELAY_SECONDS = int(os.environ.get("WORKER_MAX_RETRY_DELAY_SECONDS", 300))
 
 # --- Helper Functions ---
 def cleanup_files(files_to_delete: list[str]):
@@ -36,90 +85,652 @@ def cleanup_files(files_to_delete: list[str]):
         except OSError as e:
             print(f"Error cleaning up file {file_path}: {e}")
 
-async def call_worker_for_conversion(job_id: str, video_path: str):
+class StreamingUploadParser:
+    """
+    Callbacks for python-multipart's incremental parser. The "file" part is written straight
+    to the destination as it arrives, enforcing MAX_UPLOAD_BYTES and hashing it on the way, so
+    the body is never spooled to a temporary file first. Other parts are kept as form fields.
+    """
+
+    def __init__(self, destination: str):
+        self.destination = destination
+        self.fields: dict[str, str] = {}
+        self.file_received = False
+        self.written = 0
+        self.digest = hashlib.sha256()
+        self._buffer = None
+        self._headers: dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._part_name: str | None = None
+        self._part_data = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._part_data = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, disposition = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = disposition.get(b"name", b"").decode("latin-1")
+        if self._part_name != "file":
+            return
+        if self.file_received:
+            raise HTTPException(status_code=400, detail="Only one file can be uploaded.")
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        if not content_type.startswith("video/"):
+            raise HTTPException(status_code=400, detail="Invalid file type. Please upload a video.")
+        self.file_received = True
+        self._buffer = open(self.destination, "wb")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._part_name != "file":
+            self._part_data += chunk
+            if len(self._part_data) > MAX_FORM_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Form field {self._part_name!r} is too large.")
+            return
+        self.written += len(chunk)
+        if self.written > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes.")
+        self._buffer.write(chunk)
+        self.digest.update(chunk)
+
+    def on_part_end(self):
+        if self._part_name == "file":
+            self.close()
+        elif self._part_name:
+            self.fields[self._part_name] = self._part_data.decode("utf-8")
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+async def save_upload_stream(request: Request, destination: str) -> tuple[dict[str, str], str]:
+    """
+    Parses a multipart/form-data upload incrementally while it is received, writing its "file"
+    part to destination. Returns the other form fields and the SHA-256 hex digest of the file.
+    The partial file is removed on failure.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+
+    upload = StreamingUploadParser(destination)
+    parser = MultipartParser(boundary, upload.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+        if not upload.file_received:
+            raise HTTPException(status_code=400, detail="No video file in the upload.")
+    except BaseException:
+        upload.close()
+        cleanup_files([destination])
+        raise
+    finally:
+        upload.close()
+    return upload.fields, upload.digest.hexdigest()
+
+def hash_file(path: str) -> str:
+    """SHA-256 hex digest of a file, read in UPLOAD_CHUNK_SIZE pieces."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# --- Result Cache ---
+def worker_error_detail(response: httpx.Response):
+    """The "detail" of a worker error response, or its raw text if the body is not JSON."""
+    try:
+        return response.json().get("detail")
+    except ValueError:
+        return response.text
+
+async def result_cache_key(video_hash: str, options: dict) -> str | None:
+    """
+    Identifies a result by its input video, the effective pipeline options, the worker's config
+    version and the model version. The worker fills in its defaults, so {} and an explicit
+    default produce the same key. Options the worker rejects raise a 400; returns None
+    (no caching) if the worker cannot be asked.
+    """
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.post(f"{WORKER_URL}/options", json=options)
+        response.raise_for_status()
+        effective = response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 422:
+            raise HTTPException(status_code=400, detail=worker_error_detail(e.response))
+        print(f"Could not normalize job options, skipping the result cache: {e}")
+        return None
+    except httpx.HTTPError as e:
+        print(f"Could not normalize job options, skipping the result cache: {e}")
+        return None
+    material = json.dumps(
+        {"video": video_hash, "options": effective["options"], "config": effective["config_version"], "model": MODEL_VERSION},
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+def link_or_copy(source: str, destination: str):
+    """Hard-links a file when possible (same filesystem), copying it otherwise."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def fetch_cached_result(cache_key: str, job_id: str) -> str | None:
+    """
+    On a cache hit, links the cached result into RESULTS_DIR under the job's name (so the
+    normal download cleanup never touches the cache) and returns that path.
+    """
+    matches = glob.glob(os.path.join(RESULT_CACHE_DIR, f"{cache_key}.*"))
+    if not matches:
+        return None
+    cached_path = matches[0]
+    result_path = os.path.abspath(os.path.join(RESULTS_DIR, f"{job_id}{os.path.splitext(cached_path)[1]}"))
+    try:
+        link_or_copy(cached_path, result_path)
+        # Refresh the modification time, which eviction uses as the last-use time
+        os.utime(cached_path)
+    except OSError as e:
+        print(f"Error reading cached result {cached_path}: {e}")
+        return None
+    return result_path
+
+def store_cached_result(cache_key: str, result_path: str):
+    """Adds a finished result to the cache and evicts the least recently used entries."""
+    cached_path = os.path.join(RESULT_CACHE_DIR, f"{cache_key}{os.path.splitext(result_path)[1]}")
+    try:
+        if not os.path.exists(cached_path):
+            link_or_copy(result_path, cached_path)
+    except OSError as e:
+        print(f"Error caching result {result_path}: {e}")
+        return
+
+    entries = sorted(os.scandir(RESULT_CACHE_DIR), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    total_bytes = 0
+    for entry in entries:
+        total_bytes += entry.stat().st_size
+        if total_bytes > RESULT_CACHE_MAX_BYTES:
+            cleanup_files([entry.path])
+
+# --- Resumable Upload Sessions ---
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: str
+    options: dict | None = None
+
+def upload_session_paths(session_id: str) -> tuple[str, str]:
+    """Returns the (partial data, metadata) paths of an upload session."""
+    try:
+        session_id = str(uuid.UUID(session_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Upload session not found.")
+    return (
+        os.path.join(UPLOADS_DIR, f"{session_id}.part"),
+        os.path.join(UPLOADS_DIR, f"{session_id}.session.json"),
+    )
+
+def load_upload_session(session_id: str) -> dict:
+    """Reads an upload session's metadata and current offset from disk."""
+    data_path, meta_path = upload_session_paths(session_id)
+    try:
+        with open(meta_path) as f:
+            session = json.load(f)
+        session["offset"] = os.path.getsize(data_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found.")
+    return session
+
+def cleanup_stale_upload_sessions():
+    """Removes upload sessions that have not received data within the TTL."""
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    for name in os.listdir(UPLOADS_DIR):
+        if not name.endswith(".session.json"):
+            continue
+        try:
+            data_path, meta_path = upload_session_paths(name[: -len(".session.json")])
+        except HTTPException:
+            continue  # Not a session ID, so not a file we created
+        mtimes = []
+        for path in (data_path, meta_path):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                pass  # Completed or cleaned up by a concurrent request
+        last_activity = max(mtimes, default=None)
+        if last_activity is not None and last_activity < cutoff:
+            cleanup_files([data_path, meta_path])
+
+def parse_content_range(header: str | None, total_size: int) -> int:
+    """Parses a 'bytes start-end/total' header and returns the start offset."""
+    match = CONTENT_RANGE_PATTERN.match(header or "")
+    if not match:
+        raise HTTPException(status_code=400, detail="A 'Content-Range: bytes start-end/total' header is required.")
+    start, end, total = (int(group) for group in match.groups())
+    if total != total_size or end < start or end >= total_size:
+        raise HTTPException(status_code=416, detail="Content-Range does not match the upload session.")
+    return start
+
+def parse_job_options(raw_options: str | None) -> dict:
+    """
+    Parses the optional JSON object of per-job pipeline options (e.g. {"max_frames": 48}).
+    The worker validates the individual fields.
+    """
+    if not raw_options:
+        return {}
+    try:
+        options = json.loads(raw_options)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Options must be a JSON object.")
+    if not isinstance(options, dict):
+        raise HTTPException(status_code=400, detail="Options must be a JSON object.")
+    return options
+
+async def call_worker_for_conversion(job_id: str, video_path: str, options: dict):
     """Asynchronously calls the worker to start the conversion process."""
     # Assuming orchestrator is reachable via localhost from the worker
     # If running in different containers/machines, this needs to be the orchestrator's reachable IP
     webhook_url = f"http://localhost:8000/api/webhook/conversion-complete"
     
     async with httpx.AsyncClient(timeout=None) as client:
+        for attempt in range(WORKER_MAX_RETRIES + 1):
+            try:
+                # The worker now expects a path, not a URL
+                response = await client.post(
+                    f"{WORKER_URL}/convert",
+                    json={"job_id": job_id, "video_path": os.path.abspath(video_path), "webhook_url": webhook_url, "options": options},
+                )
+            except httpx.RequestError as e:
+                print(f"Error calling worker: {e}")
+                fail_job(job_id, "Worker could not be reached.")
+                return
+
+            if response.status_code not in (429, 503) or attempt == WORKER_MAX_RETRIES:
+                break
+            # The worker is at capacity (or still loading); wait as long as it asks before retrying
+            retry_after = response.headers.get("retry-after", "")
+            delay = min(int(retry_after) if retry_after.isdigit() else WORKER_RETRY_DELAY_SECONDS, WORKER_MAX_RETRY_DELAY_SECONDS)
+            print(f"Worker busy for job {job_id} (HTTP {response.status_code}); retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+        if response.is_error:
+            print(f"Worker rejected job {job_id}: HTTP {response.status_code} {response.text}")
+            error = "Worker is busy. Please try again later." if response.status_code in (429, 503) else f"Worker rejected the job: {response.text}"
+            fail_job(job_id, error)
+
+def fail_job(job_id: str, error: str):
+    """Marks a job failed and removes its point-cloud preview, which can no longer be downloaded."""
+    job = JOBS.patch(job_id, status="failed", error=error)
+    if job and job.get("preview_path"):
+        cleanup_files([job["preview_path"]])
+
+def discard_preview(job_id: str, preview_path: str):
+    """Deletes a preview reported for a job that is no longer processing."""
+    # Only ever delete the worker's preview file for this job, whatever path the payload names
+    if os.path.basename(preview_path) == f"{job_id}.preview.ply":
+        cleanup_files([preview_path])
+
+def recover_jobs():
+    """
+    Reconciles persisted jobs after a restart. In-flight jobs are kept so the worker's
+    webhook can still complete them; only jobs that can no longer finish are failed.
+    """
+    for job_id, job in JOBS.find(status="completed"):
+        if not os.path.exists(job.get("result_path") or ""):
+            fail_job(job_id, "Result file was lost.")
+
+    expire_jobs()
+
+    in_flight = JOBS.find(status="processing")
+    if in_flight:
+        print(f"Recovered {len(in_flight)} in-flight job(s) from the job store.")
+
+def expire_jobs():
+    """Fails jobs that exceeded JOB_TIMEOUT_SECONDS and drops expired download tombstones."""
+    for job_id, _ in JOBS.find(status="downloaded", updated_before=time.time() - DOWNLOADED_JOB_TTL_SECONDS):
+        JOBS.pop(job_id, None)
+
+    for job_id, _ in JOBS.find(status="processing", updated_before=time.time() - JOB_TIMEOUT_SECONDS):
+        print(f"Job {job_id} timed out after {JOB_TIMEOUT_SECONDS}s")
+        fail_job(job_id, "Conversion timed out.")
+
+async def sweep_jobs():
+    """Applies expire_jobs every JOB_SWEEP_INTERVAL_SECONDS while the orchestrator runs."""
+    while True:
+        await asyncio.sleep(JOB_SWEEP_INTERVAL_SECONDS)
         try:
-            # The worker now expects a path, not a URL
-            await client.post(
-                f"{WORKER_URL}/convert",
-                json={"job_id": job_id, "video_path": os.path.abspath(video_path), "webhook_url": webhook_url},
-            )
-        except httpx.RequestError as e:
-            print(f"Error calling worker: {e}")
-            JOBS[job_id] = {"status": "failed", "error": "Worker could not be reached."}
+            await asyncio.to_thread(expire_jobs)
+        except Exception as e:
+            print(f"Job sweep failed: {e}")
+
+async def start_conversion_job(background_tasks: BackgroundTasks, job_id: str, video_path: str, options: dict, video_hash: str):
+    """Registers a new job for a saved upload and hands it to the worker, unless the result is cached."""
+    try:
+        cache_key = await result_cache_key(video_hash, options)
+    except HTTPException:
+        cleanup_files([video_path])
+        raise
+    cached_result = fetch_cached_result(cache_key, job_id) if cache_key else None
+    if cached_result:
+        print(f"Result cache hit for job {job_id}")
+        JOBS[job_id] = {"status": "completed", "result_path": cached_result, "options": options, "video_hash": video_hash}
+        background_tasks.add_task(cleanup_files, [video_path])
+        return
+
+    # Set initial job status
+    JOBS[job_id] = {
+        "status": "processing",
+        "input_path": video_path,
+        "options": options,
+        "video_hash": video_hash,
+        "cache_key": cache_key,
+    }
+
+    # Trigger worker in the background
+    background_tasks.add_task(call_worker_for_conversion, job_id, video_path, options)
 
 # --- Endpoints ---
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Rejects uploads whose declared Content-Length exceeds the limit before the body is read."""
+    content_length = request.headers.get("content-length")
+    if request.url.path.startswith("/api/upload") and content_length and content_length.isdigit():
+        if int(content_length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes."},
+            )
+    return await call_next(request)
+
 @app.on_event("startup")
 def startup_event():
     """Create necessary directories on server startup."""
     os.makedirs(UPLOADS_DIR, exist_ok=True)
     os.makedirs(RESULTS_DIR, exist_ok=True)
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    cleanup_stale_upload_sessions()
+    recover_jobs()
+
+@app.on_event("startup")
+async def start_job_sweeper():
+    """Starts the periodic job timeout sweep; the task is kept on app.state so it is not collected."""
+    app.state.job_sweeper = asyncio.create_task(sweep_jobs())
 
 @app.post("/api/upload")
-async def upload_video_for_conversion(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_video_for_conversion(request: Request, background_tasks: BackgroundTasks):
     """
-    Accepts a video upload, saves it locally, and triggers the conversion worker.
+    Accepts a multipart video upload in a "file" field, streams it to disk, and triggers the
+    conversion worker. An optional "options" form field carries per-job pipeline options as JSON.
     """
-    if not file.content_type.startswith("video/"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a video.")
-
     job_id = str(uuid.uuid4())
     # Use a generic extension for simplicity, or derive properly
     video_path = os.path.join(UPLOADS_DIR, f"{job_id}.tmp")
 
-    # Save the uploaded file locally
+    # Parse the body as it arrives and write the video straight to its final path
     try:
-        with open(video_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        fields, video_hash = await save_upload_stream(request, video_path)
+    except HTTPException:
+        raise
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="Upload was interrupted.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save uploaded file: {e}")
 
+    try:
+        job_options = parse_job_options(fields.get("options"))
+    except HTTPException:
+        cleanup_files([video_path])
+        raise
 
-    # Set initial job status
-    JOBS[job_id] = {"status": "processing", "input_path": video_path}
+    await start_conversion_job(background_tasks, job_id, video_path, job_options, video_hash)
+    return JSONResponse(content={"uploadId": job_id})
 
-    # Trigger worker in the background
-    background_tasks.add_task(call_worker_for_conversion, job_id, video_path)
+@app.post("/api/uploads")
+def create_upload_session(request: UploadSessionRequest):
+    """Starts a resumable upload. The client then PUTs byte ranges and completes the session."""
+    if not request.content_type.startswith("video/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a video.")
+    if request.size <= 0 or request.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload size must be between 1 and {MAX_UPLOAD_BYTES} bytes.")
+
+    cleanup_stale_upload_sessions()
+
+    session_id = str(uuid.uuid4())
+    data_path, meta_path = upload_session_paths(session_id)
+    open(data_path, "wb").close()
+    with open(meta_path, "w") as f:
+        json.dump(
+            {
+                "session_id": session_id,
+                "filename": request.filename,
+                "size": request.size,
+                "options": request.options or {},
+                "created_at": time.time(),
+            },
+            f,
+        )
+
+    return {"sessionId": session_id, "offset": 0, "size": request.size, "chunkSize": UPLOAD_CHUNK_SIZE}
+
+@app.get("/api/uploads/{session_id}")
+def get_upload_session(session_id: str):
+    """Reports how many bytes of a resumable upload have been received."""
+    session = load_upload_session(session_id)
+    return {"sessionId": session_id, "offset": session["offset"], "size": session["size"]}
 
+@app.put("/api/uploads/{session_id}")
+async def upload_session_chunk(session_id: str, request: Request):
+    """
+    Writes one byte range of a resumable upload. Ranges may overlap data already
+    received (e.g. a retried chunk) but must not leave a gap past the current offset.
+    """
+    session = load_upload_session(session_id)
+    start = parse_content_range(request.headers.get("content-range"), session["size"])
+    if start > session["offset"]:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Chunk does not continue the upload.", "offset": session["offset"]},
+        )
+
+    data_path, _ = upload_session_paths(session_id)
+    position = start
+    try:
+        with open(data_path, "r+b") as buffer:
+            buffer.seek(start)
+            async for chunk in request.stream():
+                if position + len(chunk) > session["size"]:
+                    raise HTTPException(status_code=416, detail="Chunk extends past the declared upload size.")
+                buffer.write(chunk)
+                position += len(chunk)
+    except ClientDisconnect:
+        # Everything received before the disconnect is kept; the client resumes from GET's offset
+        print(f"Client disconnected during upload session {session_id} at offset {position}")
+
+    return {"sessionId": session_id, "offset": os.path.getsize(data_path), "size": session["size"]}
+
+@app.post("/api/uploads/{session_id}/complete")
+async def complete_upload_session(session_id: str, background_tasks: BackgroundTasks):
+    """Finalizes a fully received upload and triggers the conversion worker."""
+    session = load_upload_session(session_id)
+    if session["offset"] != session["size"]:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Upload is incomplete.", "offset": session["offset"]},
+        )
+
+    data_path, meta_path = upload_session_paths(session_id)
+    job_id = str(uuid.uuid4())
+    video_path = os.path.join(UPLOADS_DIR, f"{job_id}.tmp")
+    os.replace(data_path, video_path)
+    cleanup_files([meta_path])
+
+    video_hash = await asyncio.to_thread(hash_file, video_path)
+    await start_conversion_job(background_tasks, job_id, video_path, session.get("options", {}), video_hash)
     return JSONResponse(content={"uploadId": job_id})
 
+class RemeshRequest(BaseModel):
+    options: dict = {}
+
+@app.post("/api/remesh/{job_id}")
+async def remesh_job(job_id: str, request: RemeshRequest):
+    """
+    Re-meshes an earlier job from the worker's cached predictions with new pipeline options
+    (e.g. conf_thres, poisson_depth). Returns a new job ID to poll like a normal upload.
+    """
+    source_job = JOBS.get(job_id) or {}
+    # The worker caches predictions under the original conversion job, so re-meshes of a
+    # re-mesh read from that job's cache
+    predictions_job_id = source_job.get("source_job_id", job_id)
+    options = {**source_job.get("options", {}), **request.options}
+    new_job_id = str(uuid.uuid4())
+    webhook_url = f"http://localhost:8000/api/webhook/conversion-complete"
+
+    new_job = {"status": "processing", "source_job_id": predictions_job_id, "options": options}
+    video_hash = source_job.get("video_hash")
+    if video_hash:
+        cache_key = await result_cache_key(video_hash, options)
+        cached_result = fetch_cached_result(cache_key, new_job_id) if cache_key else None
+        if cached_result:
+            JOBS[new_job_id] = {
+                "status": "completed",
+                "result_path": cached_result,
+                "options": options,
+                "video_hash": video_hash,
+                "source_job_id": predictions_job_id,
+            }
+            return JSONResponse(content={"uploadId": new_job_id})
+        new_job.update(video_hash=video_hash, cache_key=cache_key)
+
+    # Register the job first: a fast re-mesh can call the webhook before the worker's response arrives
+    JOBS[new_job_id] = new_job
+    async with httpx.AsyncClient(timeout=30) as client:
+        try:
+            response = await client.post(
+                f"{WORKER_URL}/remesh",
+                json={"job_id": new_job_id, "source_job_id": predictions_job_id, "webhook_url": webhook_url, "options": options},
+            )
+        except httpx.RequestError as e:
+            print(f"Error calling worker: {e}")
+            JOBS.pop(new_job_id, None)
+            raise HTTPException(status_code=502, detail="Worker could not be reached.")
+    if response.is_error:
+        JOBS.pop(new_job_id, None)
+        headers = {"Retry-After": response.headers["retry-after"]} if "retry-after" in response.headers else None
+        raise HTTPException(status_code=response.status_code, detail=worker_error_detail(response), headers=headers)
+
+    return JSONResponse(content={"uploadId": new_job_id})
+
 @app.post("/api/webhook/conversion-complete")
 async def conversion_complete_webhook(payload: dict):
     """Webhook for the worker to call when conversion is done."""
     job_id = payload.get("job_id")
     result_path = payload.get("result_path")
 
-    if not job_id or job_id not in JOBS:
+    job = JOBS.get(job_id) if job_id else None
+    preview_path = payload.get("preview_path") if not result_path else None
+    if not job:
+        # A preview webhook can arrive after its job was downloaded and dropped
+        if preview_path:
+            discard_preview(job_id, preview_path)
         raise HTTPException(status_code=404, detail="Job ID not found.")
 
+    if payload.get("error"):
+        fail_job(job_id, payload["error"])
+        return JSONResponse(content={"message": "Failure recorded."})
+
+    if preview_path:
+        if job.get("status") != "processing":
+            discard_preview(job_id, preview_path)
+            return JSONResponse(content={"message": "Preview discarded."})
+        JOBS.patch(job_id, preview_path=preview_path)
+        return JSONResponse(content={"message": "Preview recorded."})
+
     if not result_path or not os.path.exists(result_path):
-        JOBS[job_id] = {"status": "failed", "error": "Worker did not provide a valid result."}
+        fail_job(job_id, "Worker did not provide a valid result.")
         raise HTTPException(status_code=400, detail="Invalid result path from worker.")
 
-    JOBS[job_id].update({"status": "completed", "result_path": result_path})
+    job = JOBS.patch(job_id, status="completed", result_path=result_path)
+    if job and job.get("cache_key"):
+        store_cached_result(job["cache_key"], result_path)
     return JSONResponse(content={"message": "Webhook received successfully."})
 
+# Media types of the result formats the worker can produce, keyed by file extension
+MODEL_MEDIA_TYPES = {
+    ".obj": "model/obj",
+    ".ply": "application/octet-stream",
+    ".glb": "model/gltf-binary",
+}
+
+def result_model_info(job_id: str, path: str, endpoint: str) -> dict:
+    """Describes a downloadable model; the format is the file extension (obj, ply or glb)."""
+    extension = os.path.splitext(path)[1]
+    return {
+        "url": f"/api/{endpoint}/{job_id}",
+        "label": f"{job_id}{extension}",
+        "format": extension.lstrip("."),
+        "media_type": MODEL_MEDIA_TYPES.get(extension, "application/octet-stream"),
+    }
+
 @app.get("/api/result/{job_id}")
 def get_conversion_result(job_id: str):
     """Pollable endpoint for the frontend to check the conversion status."""
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found.")
+    if job["status"] == "downloaded":
+        raise HTTPException(status_code=404, detail="Result was already downloaded.")
 
     if job["status"] == "completed":
-        return {"status": "completed", "model_info": {"url": f"/api/download-result/{job_id}", "label": f"{job_id}.obj"}}
+        return {"status": "completed", "model_info": result_model_info(job_id, job["result_path"], "download-result")}
+    elif job.get("preview_path") and os.path.exists(job["preview_path"]):
+        # A point cloud to show while the mesh is still being built
+        return {
+            "status": job["status"],
+            "error": job.get("error"),
+            "preview_info": result_model_info(job_id, job["preview_path"], "download-preview"),
+        }
     else:
         return {"status": job["status"], "error": job.get("error")}
 
+@app.get("/api/download-preview/{job_id}")
+def download_preview(job_id: str):
+    """Serves a job's point-cloud preview. It is cleaned up along with the final result."""
+    job = JOBS.get(job_id)
+    preview_path = job.get("preview_path") if job else None
+    if not preview_path or not os.path.exists(preview_path):
+        raise HTTPException(status_code=404, detail="Preview not found.")
+    return FileResponse(path=preview_path, media_type="application/octet-stream", filename=f"{job_id}.preview.ply")
+
 @app.get("/api/download-result/{job_id}")
 async def download_result(job_id: str, background_tasks: BackgroundTasks):
-    """Serves the final .obj file and then cleans it up along with the original upload."""
+    """Serves the final model file and then cleans it up along with the original upload."""
     job = JOBS.get(job_id)
     if not job or job.get("status") != "completed":
         raise HTTPException(status_code=404, detail="Result not ready or job not found.")
@@ -134,14 +745,21 @@ async def download_result(job_id: str, background_tasks: BackgroundTasks):
     files_to_delete = [result_path]
     if input_path:
         files_to_delete.append(input_path)
+    if job.get("preview_path"):
+        files_to_delete.append(job["preview_path"])
     background_tasks.add_task(cleanup_files, files_to_delete)
     
-    # Immediately remove the job from tracking
-    JOBS.pop(job_id, None)
+    # Drop the file paths right away, but keep what a later re-mesh needs
+    tombstone = {"status": "downloaded", "options": job.get("options", {})}
+    for key in ("video_hash", "source_job_id"):
+        if job.get(key):
+            tombstone[key] = job[key]
+    JOBS[job_id] = tombstone
 
+    extension = os.path.splitext(result_path)[1]
     return FileResponse(
         path=result_path,
-        media_type="application/octet-stream",
-        filename=f"{job_id}.obj",
+        media_type=MODEL_MEDIA_TYPES.get(extension, "application/octet-stream"),
+        filename=f"{job_id}{extension}",
     )
 
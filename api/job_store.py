@@ -0,0 +1,183 @@
+"""
+Job tracking backends for the orchestrator.
+
+Jobs are plain dicts keyed by job ID. The SQLite backend persists them so that
+in-flight jobs survive a restart and several orchestrator processes can share
+one job table; the memory backend keeps the original single-process behaviour.
+"""
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+
+
+class JobStore(ABC):
+    """Dict-like interface shared by all job store backends."""
+
+    @abstractmethod
+    def get(self, job_id: str, default: dict | None = None) -> dict | None:
+        ...
+
+    @abstractmethod
+    def set(self, job_id: str, job: dict):
+        """Creates or replaces a job record."""
+
+    @abstractmethod
+    def patch(self, job_id: str, **fields) -> dict | None:
+        """Merges fields into an existing job. Returns the updated job, or None if it does not exist."""
+
+    @abstractmethod
+    def pop(self, job_id: str, default: dict | None = None) -> dict | None:
+        ...
+
+    @abstractmethod
+    def find(self, status: str | None = None, updated_before: float | None = None) -> list[tuple[str, dict]]:
+        """Lists (job_id, job) pairs, optionally filtered by status and last update time."""
+
+    def __getitem__(self, job_id: str) -> dict:
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        return job
+
+    def __setitem__(self, job_id: str, job: dict):
+        self.set(job_id, job)
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+
+class MemoryJobStore(JobStore):
+    """Keeps jobs in a process-local dict. Jobs are lost on restart."""
+
+    def __init__(self):
+        self._jobs: dict[str, tuple[dict, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id, default=None):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            return dict(entry[0]) if entry else default
+
+    def set(self, job_id, job):
+        with self._lock:
+            self._jobs[job_id] = (dict(job), time.time())
+
+    def patch(self, job_id, **fields):
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return None
+            job = {**entry[0], **fields}
+            self._jobs[job_id] = (job, time.time())
+            return dict(job)
+
+    def pop(self, job_id, default=None):
+        with self._lock:
+            entry = self._jobs.pop(job_id, None)
+            return entry[0] if entry else default
+
+    def find(self, status=None, updated_before=None):
+        with self._lock:
+            return [
+                (job_id, dict(job))
+                for job_id, (job, updated_at) in self._jobs.items()
+                if (status is None or job.get("status") == status)
+                and (updated_before is None or updated_at < updated_before)
+            ]
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Persists jobs in a SQLite database in WAL mode, so readers never block the
+    writer and multiple processes can share the same file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs (status, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, job_id, default=None):
+        row = self._connection().execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, job_id, job):
+        now = time.time()
+        self._connection().execute(
+            """
+            INSERT INTO jobs (job_id, status, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (job_id) DO UPDATE SET status = excluded.status, data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (job_id, job.get("status", ""), json.dumps(job), now, now),
+        )
+
+    def patch(self, job_id, **fields):
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent patches cannot interleave
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            job = {**json.loads(row[0]), **fields}
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE job_id = ?",
+                (job.get("status", ""), json.dumps(job), time.time(), job_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def pop(self, job_id, default=None):
+        conn = self._connection()
+        row = conn.execute("DELETE FROM jobs WHERE job_id = ? RETURNING data", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def find(self, status=None, updated_before=None):
+        query = "SELECT job_id, data FROM jobs WHERE 1 = 1"
+        params = []
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if updated_before is not None:
+            query += " AND updated_at < ?"
+            params.append(updated_before)
+        rows = self._connection().execute(query + " ORDER BY created_at", params).fetchall()
+        return [(job_id, json.loads(data)) for job_id, data in rows]
+
+
+def create_job_store(backend: str, path: str) -> JobStore:
+    """Builds the job store selected by the JOB_STORE setting."""
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store backend: {backend}")
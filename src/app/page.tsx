@@ -4,6 +4,7 @@ import dynamic from "next/dynamic";
 import { useCallback, useEffect, useMemo, useRef, useState } from "react";
 import type { ChangeEvent, FormEvent } from "react";
 import { uploadVideo, fetchConvertedModel } from "@/lib/api";
+import type { ModelFormat } from "@/lib/api";
 
 const ConvertedModelViewer = dynamic(
   () => import("@/components/ConvertedModelViewer").then((mod) => mod.ConvertedModelViewer),
@@ -44,6 +45,7 @@ export default function HomePage() {
 
   const [modelUrl, setModelUrl] = useState<string | null>(null);
   const [modelLabel, setModelLabel] = useState("Generated Model");
+  const [modelFormat, setModelFormat] = useState<ModelFormat>("obj");
   const [isFullscreen, setIsFullscreen] = useState(false);
   const [modelLoading, setModelLoading] = useState(false);
 
@@ -327,16 +329,24 @@ export default function HomePage() {
         : `recorded-video-${Date.now()}.webm`;
 
       // The new uploadVideo function handles the multi-step direct upload process.
-      const { uploadId } = await uploadVideo(videoBlob, filename);
+      // Ask for a point-cloud preview so the viewer has something to show while the mesh is built,
+      // and for a quantized GLB, which is much smaller to download and faster to parse than OBJ.
+      const { uploadId } = await uploadVideo(videoBlob, filename, { preview: true, format: "glb", quantize: true });
       
       setStage("viewer");
       setModelLoading(true);
       showToast("업로드 완료! 모델 변환을 시작합니다. 시간이 다소 걸릴 수 있습니다.", "info");
 
       // Step 2: Poll for the result (this part remains the same).
-      const model = await fetchConvertedModel(uploadId);
+      const model = await fetchConvertedModel(uploadId, (preview) => {
+        setModelUrl(preview.url);
+        setModelFormat(preview.format);
+        setModelLabel(preview.label);
+      });
       
+      setModelLoading(true);
       setModelUrl(model.url);
+      setModelFormat(model.format);
       setModelLabel(model.label);
 
     } catch (error) {
@@ -567,6 +577,7 @@ export default function HomePage() {
               <ConvertedModelViewer
                 key={modelUrl}
                 modelUrl={modelUrl}
+                format={modelFormat}
                 onLoaded={() => {
                   setModelLoading(false);
                   showToast("3D 뷰어가 준비되었습니다.");
@@ -609,7 +620,7 @@ export default function HomePage() {
               </button>
             </div>
             <div className="mt-2 flex-1 overflow-hidden rounded-2xl bg-slate-950">
-              <ConvertedModelViewer modelUrl={modelUrl} />
+              <ConvertedModelViewer key={modelUrl} modelUrl={modelUrl} format={modelFormat} />
             </div>
           </div>
         </div>
@@ -1,27 +1,31 @@
 "use client";
 
-import { Suspense, useEffect, useState } from "react";
+import { Suspense, useEffect, useMemo, useState } from "react";
 import { Canvas, useLoader } from "@react-three/fiber";
 import { Environment, Html, OrbitControls } from "@react-three/drei";
 import { OBJLoader } from "three/examples/jsm/loaders/OBJLoader.js";
-import { Box3, Mesh, MeshStandardMaterial, Vector3 } from "three";
+import { PLYLoader } from "three/examples/jsm/loaders/PLYLoader.js";
+import { GLTFLoader } from "three/examples/jsm/loaders/GLTFLoader.js";
+import { Box3, Mesh, MeshStandardMaterial, Object3D, Vector3 } from "three";
+import type { ModelFormat } from "@/lib/api";
 
 type ConvertedModelViewerProps = {
   modelUrl: string;
+  format?: ModelFormat;
   onLoaded?: () => void;
 };
 
-function ObjectModel({
-  url,
-  onLoaded,
-  setOrbitTarget,
-}: {
+type ModelProps = {
   url: string;
   onLoaded?: () => void;
   setOrbitTarget: (target: [number, number, number]) => void;
-}) {
-  const object = useLoader(OBJLoader, url);
+};
 
+function ObjectModel({
+  object,
+  onLoaded,
+  setOrbitTarget,
+}: Omit<ModelProps, "url"> & { object: Object3D }) {
   useEffect(() => {
     // This effect runs once after the model has loaded
     const box = new Box3().setFromObject(object);
@@ -51,6 +55,49 @@ function ObjectModel({
   return <primitive object={object} />;
 }
 
+function ObjModel({ url, ...props }: ModelProps) {
+  const object = useLoader(OBJLoader, url);
+  return <ObjectModel object={object} {...props} />;
+}
+
+function GltfModel({ url, ...props }: ModelProps) {
+  const gltf = useLoader(GLTFLoader, url);
+  return <ObjectModel object={gltf.scene} {...props} />;
+}
+
+function PlyModel({ url, ...props }: ModelProps) {
+  const geometry = useLoader(PLYLoader, url);
+  const mesh = useMemo(() => {
+    if (!geometry.index) {
+      return null;
+    }
+    if (!geometry.hasAttribute("normal")) {
+      geometry.computeVertexNormals();
+    }
+    return new Mesh(geometry);
+  }, [geometry]);
+
+  // PLY results without faces are point clouds
+  return mesh ? <ObjectModel object={mesh} {...props} /> : <PointCloudModel url={url} {...props} />;
+}
+
+function PointCloudModel({ url, onLoaded, setOrbitTarget }: ModelProps) {
+  const geometry = useLoader(PLYLoader, url);
+
+  useEffect(() => {
+    geometry.computeBoundingBox();
+    const center = geometry.boundingBox?.getCenter(new Vector3()) ?? new Vector3();
+    setOrbitTarget([center.x, center.y, center.z]);
+    onLoaded?.();
+  }, [geometry, onLoaded, setOrbitTarget]);
+
+  return (
+    <points geometry={geometry}>
+      <pointsMaterial vertexColors size={0.01} sizeAttenuation />
+    </points>
+  );
+}
+
 function CanvasFallback() {
   return (
     <Html center>
@@ -64,6 +111,7 @@ function CanvasFallback() {
 
 export function ConvertedModelViewer({
   modelUrl,
+  format = "obj",
   onLoaded,
 }: ConvertedModelViewerProps) {
   const [orbitTarget, setOrbitTarget] = useState<[number, number, number]>([0, 0, 0]);
@@ -85,7 +133,13 @@ export function ConvertedModelViewer({
 
         <Suspense fallback={<CanvasFallback />}>
           <group scale={1.4}>
-            <ObjectModel url={modelUrl} onLoaded={onLoaded} setOrbitTarget={setOrbitTarget} />
+            {format === "glb" ? (
+              <GltfModel url={modelUrl} onLoaded={onLoaded} setOrbitTarget={setOrbitTarget} />
+            ) : format === "ply" ? (
+              <PlyModel url={modelUrl} onLoaded={onLoaded} setOrbitTarget={setOrbitTarget} />
+            ) : (
+              <ObjModel url={modelUrl} onLoaded={onLoaded} setOrbitTarget={setOrbitTarget} />
+            )}
           </group>
           <Environment preset="city" />
         </Suspense>
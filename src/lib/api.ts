@@ -2,14 +2,30 @@ export type UploadResponse = {
   uploadId: string;
 };
 
+type UploadSession = {
+  sessionId: string;
+  offset: number;
+  size: number;
+  chunkSize?: number;
+};
+
+export type ModelFormat = "obj" | "ply" | "glb";
+
 export type ConvertedModel = {
   url: string;
   label: string;
+  format: ModelFormat;
+  media_type: string;
 };
 
+/** Per-job pipeline options forwarded to the worker, e.g. { output: "points" } or { format: "glb" }. */
+export type ConversionOptions = Record<string, unknown>;
+
 export type ConversionStatus = {
   status: "processing" | "completed" | "failed";
   model_info: ConvertedModel | null;
+  // Point cloud published while the mesh is still being built
+  preview_info?: ConvertedModel | null;
   error?: string;
 };
 
@@ -24,16 +40,33 @@ if (process.env.VERCEL_URL) {
 const POLLING_INTERVAL_MS = 2500;
 const MAX_POLLING_ATTEMPTS = 60; // 60 attempts * 2.5 seconds = 2.5 minutes timeout
 
+// Videos larger than this are sent through the resumable upload protocol in chunks.
+const RESUMABLE_UPLOAD_THRESHOLD_BYTES = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+const CHUNK_RETRY_DELAY_MS = 2000;
+
 /**
  * Uploads the video file directly to our self-hosted backend.
  */
-export async function uploadVideo(blob: Blob, filename: string): Promise<UploadResponse> {
+export async function uploadVideo(
+  blob: Blob,
+  filename: string,
+  options?: ConversionOptions,
+): Promise<UploadResponse> {
   if (!blob || blob.size === 0) {
     throw new Error("The video to convert is missing.");
   }
 
+  if (blob.size > RESUMABLE_UPLOAD_THRESHOLD_BYTES) {
+    return uploadVideoResumable(blob, filename, options);
+  }
+
   const formData = new FormData();
   formData.append("file", blob, filename);
+  if (options) {
+    formData.append("options", JSON.stringify(options));
+  }
 
   // POST the file directly to the new /api/upload endpoint
   const response = await fetch(`${API_BASE_URL}/api/upload`, {
@@ -50,13 +83,89 @@ export async function uploadVideo(blob: Blob, filename: string): Promise<UploadR
   return response.json();
 }
 
+async function fetchUploadSession(sessionId: string): Promise<UploadSession> {
+  const response = await fetch(`${API_BASE_URL}/api/uploads/${sessionId}`);
+  if (!response.ok) {
+    throw new Error(`Failed to query upload session: ${response.status}`);
+  }
+  return response.json();
+}
+
+/**
+ * Uploads the video in chunks through a resumable upload session. After a network
+ * failure the upload continues from the last offset acknowledged by the server.
+ */
+export async function uploadVideoResumable(
+  blob: Blob,
+  filename: string,
+  options?: ConversionOptions,
+): Promise<UploadResponse> {
+  const createResponse = await fetch(`${API_BASE_URL}/api/uploads`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ filename, size: blob.size, content_type: blob.type || "video/mp4", options }),
+  });
+  if (!createResponse.ok) {
+    const errorText = await createResponse.text();
+    throw new Error(`Failed to start upload: ${createResponse.status} ${errorText}`);
+  }
+
+  const session: UploadSession = await createResponse.json();
+  const chunkSize = session.chunkSize ? Math.max(session.chunkSize, UPLOAD_CHUNK_BYTES) : UPLOAD_CHUNK_BYTES;
+  let offset = session.offset;
+  let failures = 0;
+
+  while (offset < blob.size) {
+    const end = Math.min(offset + chunkSize, blob.size);
+    try {
+      const response = await fetch(`${API_BASE_URL}/api/uploads/${session.sessionId}`, {
+        method: "PUT",
+        headers: { "Content-Range": `bytes ${offset}-${end - 1}/${blob.size}` },
+        body: blob.slice(offset, end),
+      });
+      if (!response.ok && response.status !== 409) {
+        throw new Error(`Chunk upload failed: ${response.status}`);
+      }
+      // Both success and 409 (out of sync) report the server's authoritative offset
+      offset = (await response.json()).offset;
+      failures = 0;
+    } catch (error) {
+      failures += 1;
+      if (failures > MAX_CHUNK_RETRIES) {
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, CHUNK_RETRY_DELAY_MS));
+      try {
+        offset = (await fetchUploadSession(session.sessionId)).offset;
+      } catch {
+        // Still offline; retry the same chunk on the next iteration
+      }
+    }
+  }
+
+  const completeResponse = await fetch(`${API_BASE_URL}/api/uploads/${session.sessionId}/complete`, {
+    method: "POST",
+  });
+  if (!completeResponse.ok) {
+    const errorText = await completeResponse.text();
+    throw new Error(`Failed to finalize upload: ${completeResponse.status} ${errorText}`);
+  }
+  return completeResponse.json();
+}
+
 /**
- * Polls the backend server for the result of the conversion.
+ * Polls the backend server for the result of the conversion. onPreview is called once if the
+ * server publishes a point-cloud preview before the final model is ready.
  */
-export async function fetchConvertedModel(uploadId: string): Promise<ConvertedModel> {
+export async function fetchConvertedModel(
+  uploadId: string,
+  onPreview?: (preview: ConvertedModel) => void,
+): Promise<ConvertedModel> {
   // We use a relative path for API_BASE_URL in local dev, so this works.
   const pollUrl = `${API_BASE_URL}/api/result/${uploadId}`;
 
+  let previewShown = false;
+
   for (let i = 0; i < MAX_POLLING_ATTEMPTS; i++) {
     const response = await fetch(pollUrl);
     if (!response.ok) {
@@ -71,6 +180,11 @@ export async function fetchConvertedModel(uploadId: string): Promise<ConvertedMo
       return result.model_info;
     }
 
+    if (result.preview_info && !previewShown) {
+      previewShown = true;
+      onPreview?.(result.preview_info);
+    }
+
     if (result.status === "failed") {
       throw new Error(`Model conversion failed on the server. Reason: ${result.error || 'Unknown'}`);
     }
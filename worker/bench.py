@@ -0,0 +1,137 @@
+"""
+Micro-benchmarks for the worker pipeline.
+
+Run from the worker directory with the worker environment active, e.g.:
+    python bench.py sampling path/to/video.mp4 --fps 2.0
+    python bench.py cpu-quality path/to/video.mp4 --frames 8
+    python bench.py threshold --frames 100
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+import worker
+from worker import FRAME_SAMPLING_MODES, iter_video_frames
+
+
+def bench_sampling(video_path: str, fps: float, repeats: int):
+    """Times frame extraction with every sampling mode against the decode-everything loop."""
+    print(f"Sampling {video_path} at {fps} fps ({repeats} run(s) per mode)")
+    baseline = None
+    for mode in ("read",) + tuple(m for m in FRAME_SAMPLING_MODES if m != "read"):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            frame_count = sum(1 for _ in iter_video_frames(video_path, fps, sampling=mode))
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        baseline = baseline or best
+        print(f"{mode:>5}: {best:7.3f}s for {frame_count} frames ({baseline / best:4.1f}x vs read)")
+
+
+def rotation_error_degrees(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Per-frame angle between two sets of camera rotations (extrinsics of shape (N, 3, 4))."""
+    relative = np.einsum("nji,njk->nik", reference[:, :, :3], candidate[:, :, :3])
+    cosine = np.clip((np.trace(relative, axis1=1, axis2=2) - 1) / 2, -1.0, 1.0)
+    return np.degrees(np.arccos(cosine))
+
+
+def bench_cpu_quality(video_path: str, frames: int):
+    """Compares CPU inference modes (bf16 autocast, int8) against fp32 on depth and camera poses."""
+    if worker.device != "cpu":
+        print(f"Warning: running on {worker.device}; CPU modes are only meaningful on a CPU-only node")
+    images = worker.preprocess_frames(iter_video_frames(video_path, fps=2.0, max_frames=frames))
+    state_dict = worker.load_state_dict()
+    fp32_model = worker.build_model(state_dict).eval().to(worker.device)
+
+    variants = [("fp32", fp32_model, "off")]
+    if worker.cpu_supports_bf16():
+        variants.append(("bf16", fp32_model, "bf16"))
+    variants.append(("int8", worker.quantize_for_cpu(worker.build_model(state_dict).eval().to(worker.device)), "off"))
+
+    reference = None
+    print(f"{'mode':>5} {'seconds':>8} {'depth AbsRel':>13} {'rot err (deg)':>14} {'trans err':>10}")
+    for name, model_instance, cpu_autocast in variants:
+        started = time.perf_counter()
+        predictions = worker.predict_frames(images, model_instance, cpu_autocast)
+        seconds = time.perf_counter() - started
+        if reference is None:
+            reference = predictions
+            print(f"{name:>5} {seconds:8.2f} {'-':>13} {'-':>14} {'-':>10}")
+            continue
+
+        reference_depth = reference["depth"]
+        valid = reference_depth > 1e-6
+        abs_rel = np.mean(np.abs(predictions["depth"][valid] - reference_depth[valid]) / reference_depth[valid])
+        rotation_error = rotation_error_degrees(reference["extrinsic"], predictions["extrinsic"]).mean()
+        reference_translation = reference["extrinsic"][:, :, 3]
+        translation_error = np.linalg.norm(predictions["extrinsic"][:, :, 3] - reference_translation, axis=1).mean() / max(
+            np.linalg.norm(reference_translation, axis=1).mean(), 1e-6
+        )
+        print(f"{name:>5} {seconds:8.2f} {abs_rel:13.4f} {rotation_error:14.3f} {translation_error:10.4f}")
+
+
+def bench_threshold(frames: int, percentile: float, repeats: int):
+    """Times percentile thresholding of synthetic depth confidences against np.percentile."""
+    rng = np.random.default_rng(0)
+    # VGGT confidences are >= 1 with a long upper tail; a shifted log-normal is a close stand-in
+    confidence = (1.0 + rng.lognormal(0.5, 1.0, size=(frames, 518, 518))).astype(np.float32)
+    reference = float(np.percentile(confidence, percentile))
+    print(f"{confidence.size / 1e6:.1f}M confidences, {percentile}th percentile ({repeats} run(s) per method)")
+
+    candidates = [
+        ("np.percentile", lambda: np.percentile(confidence, percentile)),
+        ("exact", lambda: worker.percentile_threshold(confidence, percentile, "exact")),
+        ("histogram", lambda: worker.percentile_threshold(confidence, percentile, "histogram")),
+    ]
+    tensor = torch.from_numpy(confidence).to(worker.device)
+    for method in worker.THRESHOLD_METHODS:
+        candidates.append((f"torch {method}", lambda method=method: worker.percentile_threshold(tensor, percentile, method)))
+
+    baseline = None
+    for name, run in candidates:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            threshold = float(run())
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        baseline = baseline or best
+        kept = np.count_nonzero(confidence >= threshold) / confidence.size
+        print(
+            f"{name:>15}: {best:7.3f}s ({baseline / best:4.1f}x) threshold {threshold:.4f} "
+            f"(ref {reference:.4f}), keeps {kept:.2%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    sampling = subparsers.add_parser("sampling", help="Compare frame sampling modes on a video.")
+    sampling.add_argument("video_path")
+    sampling.add_argument("--fps", type=float, default=2.0)
+    sampling.add_argument("--repeats", type=int, default=3)
+
+    cpu_quality = subparsers.add_parser("cpu-quality", help="Compare CPU inference modes against fp32.")
+    cpu_quality.add_argument("video_path")
+    cpu_quality.add_argument("--frames", type=int, default=8)
+
+    threshold = subparsers.add_parser("threshold", help="Compare confidence thresholding methods on synthetic data.")
+    threshold.add_argument("--frames", type=int, default=100)
+    threshold.add_argument("--percentile", type=float, default=50.0)
+    threshold.add_argument("--repeats", type=int, default=3)
+
+    args = parser.parse_args()
+    if args.benchmark == "sampling":
+        bench_sampling(args.video_path, args.fps, args.repeats)
+    elif args.benchmark == "cpu-quality":
+        bench_cpu_quality(args.video_path, args.frames)
+    elif args.benchmark == "threshold":
+        bench_threshold(args.frames, args.percentile, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Minimal binary glTF (GLB) writer for the worker's colored triangle meshes.
+
+Only what the viewer needs is written: one mesh with positions, optional normals and
+vertex colors, and triangle indices. With quantize=True, attributes use the compact
+encodings allowed by KHR_mesh_quantization (16-bit positions dequantized by the node
+transform, 8-bit normals), roughly halving the file size.
+"""
+import json
+import struct
+
+import numpy as np
+
+# glTF component types
+BYTE = 5120
+UNSIGNED_BYTE = 5121
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+FLOAT = 5126
+
+COMPONENT_TYPES = {
+    np.dtype(np.int8): BYTE,
+    np.dtype(np.uint8): UNSIGNED_BYTE,
+    np.dtype(np.uint16): UNSIGNED_SHORT,
+    np.dtype(np.uint32): UNSIGNED_INT,
+    np.dtype(np.float32): FLOAT,
+}
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+class _BufferBuilder:
+    """Accumulates bufferViews and accessors over a single binary buffer."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.buffer_views: list[dict] = []
+        self.accessors: list[dict] = []
+
+    def add(self, values: np.ndarray, accessor_type: str, target: int, normalized: bool = False, bounds: bool = False) -> int:
+        """Appends values of shape (count, components) or (count,) and returns the accessor index."""
+        values = np.ascontiguousarray(values)
+        count = len(values)
+        components = values.shape[1] if values.ndim == 2 else 1
+        view = {"buffer": 0, "byteOffset": len(self.data), "target": target}
+
+        element_size = values.dtype.itemsize * components
+        if target == ARRAY_BUFFER and element_size % 4:
+            # Vertex attribute elements must be 4-byte aligned, so pad each one with zeros
+            padded_components = -(-element_size // 4) * 4 // values.dtype.itemsize
+            padded = np.zeros((count, padded_components), dtype=values.dtype)
+            padded[:, :components] = values
+            view["byteStride"] = padded_components * values.dtype.itemsize
+            values = padded
+
+        self.data += values.tobytes()
+        view["byteLength"] = len(self.data) - view["byteOffset"]
+        self.data += b"\0" * (-len(self.data) % 4)
+        self.buffer_views.append(view)
+
+        accessor = {
+            "bufferView": len(self.buffer_views) - 1,
+            "componentType": COMPONENT_TYPES[values.dtype],
+            "count": count,
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if bounds:
+            accessor["min"] = values[:, :components].min(axis=0).tolist()
+            accessor["max"] = values[:, :components].max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+
+def write_glb(
+    path: str,
+    positions: np.ndarray,
+    triangles: np.ndarray,
+    colors: np.ndarray | None = None,
+    normals: np.ndarray | None = None,
+    quantize: bool = False,
+):
+    """Writes a triangle mesh as GLB. Colors are RGB in [0, 1]; normals are unit vectors."""
+    if len(positions) == 0 or len(triangles) == 0:
+        raise ValueError("Cannot write an empty mesh as GLB.")
+    builder = _BufferBuilder()
+    node = {"mesh": 0}
+    extensions = []
+    attributes = {}
+
+    positions = np.asarray(positions, dtype=np.float64)
+    if quantize and len(positions):
+        # Positions become 16-bit grid coordinates; the node transform maps them back to world space
+        low = positions.min(axis=0)
+        scale = np.maximum(positions.max(axis=0) - low, 1e-12) / 65535.0
+        quantized = np.round((positions - low) / scale).astype(np.uint16)
+        attributes["POSITION"] = builder.add(quantized, "VEC3", ARRAY_BUFFER, bounds=True)
+        node["translation"] = low.tolist()
+        node["scale"] = scale.tolist()
+        extensions.append("KHR_mesh_quantization")
+    else:
+        attributes["POSITION"] = builder.add(positions.astype(np.float32), "VEC3", ARRAY_BUFFER, bounds=True)
+
+    if normals is not None and len(normals):
+        normals = np.asarray(normals, dtype=np.float32)
+        if quantize:
+            # Non-uniform node scale would skew normals, so undo it before storing them
+            normals = normals * np.asarray(node.get("scale", [1.0, 1.0, 1.0]), dtype=np.float32)
+            normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+            normals = np.round(normals * 127).astype(np.int8)
+            attributes["NORMAL"] = builder.add(normals, "VEC3", ARRAY_BUFFER, normalized=True)
+        else:
+            attributes["NORMAL"] = builder.add(normals, "VEC3", ARRAY_BUFFER)
+
+    if colors is not None and len(colors):
+        colors = np.round(np.clip(np.asarray(colors, dtype=np.float32), 0, 1) * 255).astype(np.uint8)
+        attributes["COLOR_0"] = builder.add(colors, "VEC3", ARRAY_BUFFER, normalized=True)
+
+    indices = np.asarray(triangles).reshape(-1)
+    index_dtype = np.uint16 if len(positions) <= 0xFFFF else np.uint32
+    index_accessor = builder.add(indices.astype(index_dtype), "SCALAR", ELEMENT_ARRAY_BUFFER)
+
+    document = {
+        "asset": {"version": "2.0", "generator": "3D_inter worker"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [node],
+        "meshes": [{"primitives": [{"attributes": attributes, "indices": index_accessor, "mode": 4}]}],
+        "accessors": builder.accessors,
+        "bufferViews": builder.buffer_views,
+        "buffers": [{"byteLength": len(builder.data)}],
+    }
+    if extensions:
+        document["extensionsUsed"] = extensions
+        document["extensionsRequired"] = extensions
+
+    json_chunk = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    binary_chunk = bytes(builder.data)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(json_chunk) + 8 + len(binary_chunk)))
+        f.write(struct.pack("<I4s", len(json_chunk), b"JSON"))
+        f.write(json_chunk)
+        f.write(struct.pack("<I4s", len(binary_chunk), b"BIN\0"))
+        f.write(binary_chunk)
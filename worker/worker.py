@@ -1,52 +1,296 @@
 import os
 import shutil
+import asyncio
 import httpx
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from pydantic import BaseModel
-from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field
+from typing import Annotated, Literal
+from dataclasses import dataclass, field
+from contextlib import asynccontextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import gc
 import sys
-import glob
+import json
+import hashlib
+import math
+import time
 
 # --- VGGT and ML Imports ---
 import cv2
 import torch
 import numpy as np
 import open3d as o3d
+from safetensors.torch import load_file as load_safetensors, save_file as save_safetensors
 from vggt.models.vggt import VGGT
-from vggt.utils.load_fn import load_and_preprocess_images
+from vggt.models.aggregator import _RESNET_MEAN, _RESNET_STD
+from PIL import Image
 from vggt.utils.pose_enc import pose_encoding_to_extri_intri
 from vggt.utils.geometry import unproject_depth_map_to_point_map
+from glb import write_glb
 
 # --- Global model instance ---
 device = "cuda" if torch.cuda.is_available() else "cpu"
 model = None
 
+# --- Pipeline Configuration ---
+# Jobs flow through three stages (extract -> inference -> mesh), each with its own worker pool,
+# so one job's frame extraction and another's meshing overlap with the current inference.
+# MAX_CONCURRENT_JOBS bounds concurrent VGGT inferences (one by default). Up to MAX_QUEUED_JOBS
+# jobs wait for extraction; anything beyond that is rejected with 429. STAGE_QUEUE_SIZE bounds
+# the finished-but-not-yet-picked-up jobs between stages, which caps the frames and predictions
+# held in memory.
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", 1))
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 1))
+MESH_WORKERS = int(os.environ.get("MESH_WORKERS", 1))
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 8))
+STAGE_QUEUE_SIZE = int(os.environ.get("STAGE_QUEUE_SIZE", 1))
+
+# How frames are skipped during extraction: "auto", "grab", "seek" or "read" (decode everything).
+# "auto" seeks when kept frames are at least SEEK_MIN_FRAME_INTERVAL frames apart.
+FRAME_SAMPLING_MODES = ("auto", "grab", "seek", "read")
+FRAME_SAMPLING = os.environ.get("FRAME_SAMPLING", "auto")
+SEEK_MIN_FRAME_INTERVAL = int(os.environ.get("SEEK_MIN_FRAME_INTERVAL", 30))
+
+# Keyframe selection: "fixed" samples at a constant rate; "adaptive" scores candidates taken at
+# KEYFRAME_CANDIDATE_FPS by sharpness, optical-flow motion and similarity, and keeps at most
+# the job's frame budget of them. Scoring runs on KEYFRAME_ANALYSIS_WIDTH-pixel-wide grayscale copies.
+KEYFRAME_SELECTION_MODES = ("fixed", "adaptive")
+KEYFRAME_SELECTION = os.environ.get("KEYFRAME_SELECTION", "fixed")
+KEYFRAME_CANDIDATE_FPS = float(os.environ.get("KEYFRAME_CANDIDATE_FPS", 6.0))
+KEYFRAME_ANALYSIS_WIDTH = int(os.environ.get("KEYFRAME_ANALYSIS_WIDTH", 160))
+# Percentile of per-pixel flow magnitude used as a frame pair's motion. A high percentile
+# registers a moving subject or near foreground even when most of the frame is static background
+KEYFRAME_MOTION_PERCENTILE = float(os.environ.get("KEYFRAME_MOTION_PERCENTILE", 90.0))
+# Total flow (analysis pixels) below which the clip is treated as static
+KEYFRAME_MIN_MOTION = float(os.environ.get("KEYFRAME_MIN_MOTION", 2.0))
+# Correlation above which a candidate is a near duplicate of the previous keyframe
+KEYFRAME_MAX_SIMILARITY = float(os.environ.get("KEYFRAME_MAX_SIMILARITY", 0.98))
+
+# --- Frame Budget ---
+# VGGT's memory grows with the number of frames in a forward pass. Published VGGT-1B figures at
+# 518px are roughly 1.9 GB plus 0.2 GB per frame under fp16/bf16; fp32 on CPU about doubles that.
+VGGT_BASE_MEMORY_GB = 1.9
+VGGT_PER_FRAME_MEMORY_GB = 0.2
+MIN_FRAMES = 2
+
+def default_max_frames() -> int:
+    """Largest frame count that fits in ~85% of the inference device's memory."""
+    if device == "cuda":
+        available_gb = torch.cuda.get_device_properties(0).total_memory / 1024**3
+        scale = 1.0
+    else:
+        available_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+        scale = 2.0
+    frames = int((0.85 * available_gb - VGGT_BASE_MEMORY_GB * scale) / (VGGT_PER_FRAME_MEMORY_GB * scale))
+    return max(MIN_FRAMES, frames)
+
+# Windowed inference: sequences longer than INFERENCE_WINDOW frames are processed in
+# overlapping windows that are aligned afterwards. "auto" sizes windows to the device memory;
+# 0 disables windowing so every job runs in a single forward pass.
+_inference_window = os.environ.get("INFERENCE_WINDOW", "0")
+INFERENCE_WINDOW = default_max_frames() if _inference_window == "auto" else int(_inference_window)
+INFERENCE_WINDOW_OVERLAP = int(os.environ.get("INFERENCE_WINDOW_OVERLAP", 4))
+# Correspondences sampled from the overlap to estimate each window's alignment
+ALIGNMENT_MAX_POINTS = int(os.environ.get("ALIGNMENT_MAX_POINTS", 50000))
+if INFERENCE_WINDOW and not 0 < INFERENCE_WINDOW_OVERLAP < INFERENCE_WINDOW:
+    raise ValueError("INFERENCE_WINDOW_OVERLAP must be positive and smaller than INFERENCE_WINDOW.")
+
+# Per-job cap on frames passed to the model; the extractor lowers the sampling rate to stay within
+# it. Without windowing it is what fits in one forward pass; with windowing it only bounds job time.
+WINDOWED_MAX_FRAMES = int(os.environ.get("WINDOWED_MAX_FRAMES", 400))
+MAX_FRAMES = int(os.environ.get("MAX_FRAMES", 0)) or (WINDOWED_MAX_FRAMES if INFERENCE_WINDOW else default_max_frames())
+
+# Write sampled frames to worker_temp as PNGs for debugging; frames otherwise stay in memory
+DEBUG_DUMP_FRAMES = os.environ.get("DEBUG_DUMP_FRAMES", "0") == "1"
+
+# Initial per-stage duration estimate used for Retry-After before any job has finished
+DEFAULT_STAGE_SECONDS = float(os.environ.get("DEFAULT_STAGE_SECONDS", 60))
+
+# Maps each job currently in the pipeline to the stage it is in, for the health endpoint
+ACTIVE_JOBS: dict[str, str] = {}
+
+# --- Model Loading ---
+# The worker loads VGGT from a local safetensors checkpoint when present, memory-mapping it.
+# Otherwise it downloads the published weights once and writes the local checkpoint for the next
+# start. VGGT_OFFLINE=1 forbids the download, for air-gapped deployments.
+VGGT_CHECKPOINT = os.environ.get("VGGT_CHECKPOINT", "checkpoints/vggt-1b.safetensors")
+VGGT_CHECKPOINT_URL = "https://huggingface.co/facebook/VGGT-1B/resolve/main/model.pt"
+VGGT_OFFLINE = os.environ.get("VGGT_OFFLINE", "0") == "1"
+model_load_seconds = None
+
+# --- CPU Inference ---
+# On CPU-only nodes VGGT runs under bf16 autocast where the CPU supports it (CPU_AUTOCAST=auto|bf16|off).
+# CPU_QUANTIZE=1 additionally converts the aggregator transformer's Linear layers to dynamic int8;
+# quantized layers take fp32 activations, so autocast is skipped for a quantized model.
+# CPU_THREADS sets the intra-op thread count (default: all cores).
+CPU_AUTOCAST = os.environ.get("CPU_AUTOCAST", "auto")
+CPU_QUANTIZE = os.environ.get("CPU_QUANTIZE", "0") == "1"
+CPU_THREADS = int(os.environ.get("CPU_THREADS", 0)) or os.cpu_count()
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+def quantize_for_cpu(instance: VGGT) -> VGGT:
+    """Applies dynamic int8 quantization to the Linear layers of the aggregator transformer."""
+    torch.ao.quantization.quantize_dynamic(instance.aggregator, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    instance.int8_quantized = True
+    return instance
+
+# --- Compiled Inference ---
+# COMPILE_MODEL=1 wraps VGGT in torch.compile. The frame count is marked as a dynamic dimension, so
+# one graph serves every frame count; padding to fixed frame buckets would change the results,
+# since padded frames take part in VGGT's global attention. Input heights are the remaining shape
+# buckets: frames are 518 wide, with heights a multiple of 14 set by the aspect ratio. The lifespan
+# hook compiles the WARMUP_HEIGHTS buckets (16:9, 4:3 and square/portrait by default) before the
+# first request. MODEL_WARMUP also works without compilation, to initialize CUDA kernels up front.
+COMPILE_MODEL = os.environ.get("COMPILE_MODEL", "0") == "1"
+COMPILE_MODE = os.environ.get("COMPILE_MODE", "default")
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1" if COMPILE_MODEL else "0") == "1"
+WARMUP_HEIGHTS = [int(height) for height in os.environ.get("WARMUP_HEIGHTS", "294,392,518").split(",")]
+WARMUP_FRAMES = int(os.environ.get("WARMUP_FRAMES", 4))
+
+def compile_model(instance: VGGT):
+    """Wraps the model in torch.compile; quantized models stay eager."""
+    if getattr(instance, "int8_quantized", False):
+        print("Skipping torch.compile for the int8-quantized model")
+        return instance
+    print(f"Compiling model with torch.compile (mode={COMPILE_MODE})")
+    return torch.compile(instance, mode=COMPILE_MODE)
+
+def warmup_model():
+    """Runs one forward pass per input-height bucket so compilation happens before the first job."""
+    for height in WARMUP_HEIGHTS:
+        started = time.perf_counter()
+        predict_frames(torch.rand(WARMUP_FRAMES, 3, height, 518), model)
+        print(f"Warmup for {height}x518 inputs took {time.perf_counter() - started:.1f}s")
+    release_memory()
+
+# --- Head Stripping ---
+# The mesher only needs depth, depth confidence and cameras (plus the input colors). With
+# STRIP_UNUSED_HEADS the point and tracking heads are dropped after loading (freeing their weights
+# and compute) and only the needed outputs are copied from the device.
+STRIP_UNUSED_HEADS = os.environ.get("STRIP_UNUSED_HEADS", "1") == "1"
+MESH_PREDICTION_KEYS = ("depth", "depth_conf", "extrinsic", "intrinsic")
+
+def strip_unused_heads(instance: VGGT) -> VGGT:
+    """Removes the heads whose outputs the meshing pipeline never reads; VGGT skips heads set to None."""
+    for head in ("point_head", "track_head"):
+        if getattr(instance, head, None) is not None:
+            setattr(instance, head, None)
+    return instance
+
+def inference_autocast(model_instance, cpu_autocast: str = CPU_AUTOCAST):
+    """Mixed-precision context for a forward pass on the current device."""
+    if device == "cuda":
+        dtype = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+        return torch.autocast("cuda", dtype=dtype)
+    if getattr(model_instance, "int8_quantized", False) or cpu_autocast == "off":
+        return nullcontext()
+    if cpu_autocast == "bf16" or cpu_supports_bf16():
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
+
+# Values of VGGT's non-persistent buffers, which are not in the checkpoint and so must be
+# rebuilt after meta-device construction (the aggregator's ResNet input normalization)
+NON_PERSISTENT_BUFFERS = {"_resnet_mean": _RESNET_MEAN, "_resnet_std": _RESNET_STD}
+
+def build_model(state_dict: dict) -> VGGT:
+    """
+    Constructs VGGT on the meta device, skipping random weight initialization, and adopts
+    the loaded tensors as its parameters. Non-persistent buffers are then rebuilt from
+    NON_PERSISTENT_BUFFERS. Falls back to a regular construction only if some other tensor
+    was left without data.
+    """
+    with torch.device("meta"):
+        instance = VGGT()
+    instance.load_state_dict(state_dict, strict=True, assign=True)
+
+    target_device = next(instance.parameters()).device
+    for module in instance.modules():
+        for name, buffer in list(module.named_buffers(recurse=False)):
+            if buffer.is_meta and name in NON_PERSISTENT_BUFFERS:
+                value = torch.tensor(NON_PERSISTENT_BUFFERS[name], dtype=buffer.dtype, device=target_device)
+                module.register_buffer(name, value.view(buffer.shape), persistent=False)
+
+    uninitialized = [
+        name for name, tensor in [*instance.named_parameters(), *instance.named_buffers()] if tensor.is_meta
+    ]
+    if not uninitialized:
+        print("Built VGGT on the meta device from the checkpoint tensors")
+        return instance
+
+    print(f"Meta-device construction left tensors uninitialized ({', '.join(uninitialized)}); constructing normally")
+    instance = VGGT()
+    instance.load_state_dict(state_dict)
+    return instance
+
+def load_state_dict() -> dict:
+    """Reads the VGGT weights, preferring the memory-mapped local safetensors checkpoint."""
+    if os.path.exists(VGGT_CHECKPOINT):
+        print(f"Loading weights from {VGGT_CHECKPOINT}")
+        # safetensors memory-maps the file; tensors are only read as they are used
+        return load_safetensors(VGGT_CHECKPOINT, device=device)
+
+    if VGGT_OFFLINE:
+        raise FileNotFoundError(f"VGGT_OFFLINE is set but no checkpoint exists at {VGGT_CHECKPOINT}")
+
+    print(f"Downloading weights from {VGGT_CHECKPOINT_URL}")
+    state_dict = torch.hub.load_state_dict_from_url(VGGT_CHECKPOINT_URL, map_location="cpu")
+    try:
+        os.makedirs(os.path.dirname(VGGT_CHECKPOINT) or ".", exist_ok=True)
+        save_safetensors({key: value.contiguous() for key, value in state_dict.items()}, VGGT_CHECKPOINT)
+        print(f"Saved local checkpoint to {VGGT_CHECKPOINT}")
+    except Exception as e:
+        print(f"Could not save local checkpoint: {e}")
+    return state_dict
+
 def load_model():
     """Load VGGT model once at startup"""
-    global model
+    global model, model_load_seconds
     if model is not None:
         return
     print("Initializing and loading VGGT model...")
+    started = time.perf_counter()
     try:
-        model = VGGT()
-        _URL = "https://huggingface.co/facebook/VGGT-1B/resolve/main/model.pt"
-        model.load_state_dict(torch.hub.load_state_dict_from_url(_URL))
-        model.eval()
-        model = model.to(device)
-        print(f"Model loaded successfully on {device}")
+        instance = build_model(load_state_dict())
+        if STRIP_UNUSED_HEADS:
+            instance = strip_unused_heads(instance)
+        instance.eval()
+        instance = instance.to(device)
+        if device == "cpu":
+            torch.set_num_threads(CPU_THREADS)
+            if CPU_QUANTIZE:
+                instance = quantize_for_cpu(instance)
+            print(f"CPU inference: {CPU_THREADS} threads, int8={CPU_QUANTIZE}, autocast={CPU_AUTOCAST}")
+        if COMPILE_MODEL:
+            instance = compile_model(instance)
+        model = instance
+        model_load_seconds = time.perf_counter() - started
+        print(f"Model loaded successfully on {device} in {model_load_seconds:.1f}s")
     except Exception as e:
         print(f"FATAL: Could not load VGGT model: {e}")
         model = None
 
 @asynccontextmanager
 async def lifespan(app_instance: FastAPI):
-    """Load model when server starts"""
+    """Load model and start the pipeline stages when server starts"""
+    global model
     load_model()
+    if model is not None and MODEL_WARMUP:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, warmup_model)
+        except Exception as e:
+            print(f"Model warmup failed: {e}")
+    for stage in PIPELINE_STAGES:
+        stage.start()
     yield
     # Cleanup on shutdown
-    global model
+    for stage in PIPELINE_STAGES:
+        stage.stop()
     del model
     gc.collect()
     torch.cuda.empty_cache()
@@ -62,60 +306,275 @@ WORKER_TEMP_DIR = "worker_temp" # For intermediate files like frames
 os.makedirs(RESULTS_DIR, exist_ok=True)
 os.makedirs(WORKER_TEMP_DIR, exist_ok=True)
 
+# Per-job prediction caches, so a job can be re-meshed with new parameters without re-running
+# inference. Only the PREDICTIONS_CACHE_MAX_JOBS most recently written caches are kept.
+PREDICTIONS_DIR = "worker_predictions"
+CACHE_PREDICTIONS = os.environ.get("CACHE_PREDICTIONS", "1") == "1"
+PREDICTIONS_CACHE_MAX_JOBS = int(os.environ.get("PREDICTIONS_CACHE_MAX_JOBS", 20))
+os.makedirs(PREDICTIONS_DIR, exist_ok=True)
+
+# --- Meshing ---
+# Percentile thresholds (depth confidence, Poisson density) use partial selection instead of a
+# full sort. "histogram" trades exactness for a single pass over the values: the threshold is
+# the lower edge of the histogram bin holding the percentile, so it never drops extra values.
+THRESHOLD_METHODS = ("exact", "histogram")
+THRESHOLD_METHOD = os.environ.get("THRESHOLD_METHOD", "exact")
+THRESHOLD_HISTOGRAM_BINS = int(os.environ.get("THRESHOLD_HISTOGRAM_BINS", 4096))
+if THRESHOLD_METHOD not in THRESHOLD_METHODS:
+    raise ValueError(f"THRESHOLD_METHOD must be one of {THRESHOLD_METHODS}, got {THRESHOLD_METHOD!r}")
+# Overlapping frames see the same surfaces many times over, so the filtered points are merged on a
+# voxel grid (averaging colors) before normal estimation. "auto" sizes voxels to the scene's
+# bounding-box diagonal divided by VOXEL_GRID_RESOLUTION, which bounds the point count regardless
+# of frame count or resolution; 0 disables downsampling.
+_voxel_size = os.environ.get("VOXEL_SIZE", "auto")
+VOXEL_SIZE = _voxel_size if _voxel_size == "auto" else float(_voxel_size)
+VOXEL_GRID_RESOLUTION = int(os.environ.get("VOXEL_GRID_RESOLUTION", 512))
+NORMAL_RADIUS = 0.05
+# Surface reconstruction backend. "poisson" fits a watertight surface to the filtered points;
+# "tsdf" fuses the depth maps frame by frame into a voxel-hashed signed distance volume and
+# extracts it with marching cubes, which is faster and memory-bounded on dense captures. TSDF
+# voxels follow VOXEL_SIZE, truncating the distance field at TSDF_TRUNCATION_VOXELS voxels.
+MESHERS = ("poisson", "tsdf")
+MESHER = os.environ.get("MESHER", "poisson")
+TSDF_TRUNCATION_VOXELS = float(os.environ.get("TSDF_TRUNCATION_VOXELS", 4))
+if MESHER not in MESHERS:
+    raise ValueError(f"MESHER must be one of {MESHERS}, got {MESHER!r}")
+# Result written by a job: "mesh" runs the mesher; "points" stops after confidence filtering and
+# writes the colored point cloud as binary PLY, voxel-downsampled like the mesher's input.
+OUTPUT_MODES = ("mesh", "points")
+OUTPUT_MODE = os.environ.get("OUTPUT_MODE", "mesh")
+if OUTPUT_MODE not in OUTPUT_MODES:
+    raise ValueError(f"OUTPUT_MODE must be one of {OUTPUT_MODES}, got {OUTPUT_MODE!r}")
+# Mesh file format: ASCII "obj" (the original output), binary "ply", or "glb". GLB results can
+# also be quantized (KHR_mesh_quantization) for smaller transfers. Point-cloud output is always PLY.
+RESULT_FORMATS = ("obj", "ply", "glb")
+RESULT_FORMAT = os.environ.get("RESULT_FORMAT", "obj")
+QUANTIZE_RESULTS = os.environ.get("QUANTIZE_RESULTS", "0") == "1"
+if RESULT_FORMAT not in RESULT_FORMATS:
+    raise ValueError(f"RESULT_FORMAT must be one of {RESULT_FORMATS}, got {RESULT_FORMAT!r}")
+# Poisson octree depth. "auto" picks the depth whose cells match the point spacing within the
+# scene's bounding cube. Every depth, automatic or explicit, is capped at POISSON_MAX_DEPTH: each
+# extra level roughly quadruples reconstruction time and memory, so the cap is the meshing budget.
+_poisson_depth = os.environ.get("POISSON_DEPTH", "8")
+POISSON_DEPTH = _poisson_depth if _poisson_depth == "auto" else int(_poisson_depth)
+POISSON_MIN_DEPTH = int(os.environ.get("POISSON_MIN_DEPTH", 6))
+POISSON_MAX_DEPTH = int(os.environ.get("POISSON_MAX_DEPTH", 10))
+POISSON_SCALE = 1.1
+# Points sampled to estimate the typical nearest-neighbour spacing
+POISSON_SPACING_SAMPLES = 20000
+
 
 # --- Actual 3D Model Conversion Logic (largely unchanged) ---
 
-def extract_frames_from_video(video_path: str, output_dir: str, fps: float = 3.0) -> list[str]:
+def sample_video_frames(vs: cv2.VideoCapture, frame_interval: int = 1, sampling: str = "auto", frame_indices: list[int] | None = None):
+    """
+    Yields (frame index, BGR frame) for every frame_interval-th frame of an open capture,
+    or for exactly the sorted frame_indices when given.
+
+    "read" decodes and converts every frame (the original behaviour). "grab" advances with
+    grab() and only retrieve()s kept frames, skipping color conversion and copies for the
+    rest. "seek" jumps straight to each kept frame, which avoids decoding most skipped frames
+    when they are far apart. "auto" seeks for sparse sampling and grabs otherwise.
+    """
+    frame_count = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_indices is not None:
+        wanted = set(frame_indices)
+        last_index = max(frame_indices, default=-1)
+        keep = wanted.__contains__
+        if len(frame_indices) > 1:
+            frame_interval = max(1, (frame_indices[-1] - frame_indices[0]) // (len(frame_indices) - 1))
+    else:
+        last_index = None
+        keep = lambda index: index % frame_interval == 0
+    if sampling == "auto":
+        sampling = "seek" if frame_interval >= SEEK_MIN_FRAME_INTERVAL and frame_count > 0 else "grab"
+
+    if sampling == "seek":
+        seek_indices = frame_indices if frame_indices is not None else range(0, frame_count, frame_interval)
+        for index in seek_indices:
+            vs.set(cv2.CAP_PROP_POS_FRAMES, index)
+            gotit, frame = vs.read()
+            if not gotit:
+                break
+            yield index, frame
+        return
+
+    count = 0
+    while last_index is None or count <= last_index:
+        if sampling == "read":
+            gotit, frame = vs.read()
+        else:
+            gotit = vs.grab()
+            frame = None
+        if not gotit:
+            break
+
+        if keep(count):
+            if frame is None:
+                gotit, frame = vs.retrieve()
+                if not gotit:
+                    break
+            yield count, frame
+        count += 1
+
+def frame_sharpness(gray: np.ndarray) -> float:
+    """Variance of the Laplacian; low values indicate motion blur or defocus."""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def frame_motion(previous_gray: np.ndarray, gray: np.ndarray) -> float:
+    """KEYFRAME_MOTION_PERCENTILE of optical-flow magnitude between two frames, in analysis-resolution pixels."""
+    flow = cv2.calcOpticalFlowFarneback(previous_gray, gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+    return float(np.percentile(np.linalg.norm(flow, axis=2), KEYFRAME_MOTION_PERCENTILE))
+
+def frame_similarity(gray_a: np.ndarray, gray_b: np.ndarray) -> float:
+    """Normalized cross-correlation of two equally sized frames, in [-1, 1]."""
+    return float(cv2.matchTemplate(gray_a, gray_b, cv2.TM_CCOEFF_NORMED)[0, 0])
+
+def select_keyframes(gray_frames: list[np.ndarray], max_frames: int) -> list[int]:
+    """
+    Picks up to max_frames informative frames from a list of small grayscale candidates.
+
+    The clip is split into max_frames segments of equal accumulated optical-flow motion, so
+    fast pans get more keyframes and a still camera gets few. The sharpest candidate of each
+    segment is kept unless it is a near duplicate of the previously kept frame. At least
+    min(MIN_FRAMES, len(gray_frames)) frames are returned, topped up with the sharpest
+    candidates of equal-length stretches of the clip. Returns indices into gray_frames in
+    temporal order.
+    """
+    min_count = min(MIN_FRAMES, len(gray_frames))
+    if len(gray_frames) <= min_count:
+        return list(range(len(gray_frames)))
+
+    sharpness = np.array([frame_sharpness(gray) for gray in gray_frames])
+    motion = np.array([0.0] + [frame_motion(a, b) for a, b in zip(gray_frames, gray_frames[1:])])
+    cumulative_motion = np.cumsum(motion)
+    total_motion = cumulative_motion[-1]
+    selected = []
+    if total_motion >= KEYFRAME_MIN_MOTION:
+        segment = np.minimum((cumulative_motion / total_motion * max_frames).astype(int), max_frames - 1)
+        for segment_id in np.unique(segment):
+            members = np.flatnonzero(segment == segment_id)
+            best = int(members[np.argmax(sharpness[members])])
+            if selected and frame_similarity(gray_frames[selected[-1]], gray_frames[best]) > KEYFRAME_MAX_SIMILARITY:
+                continue
+            selected.append(best)
+
+    if len(selected) < min_count:
+        # Static scene or heavy de-duplication: VGGT still needs several views, so add the
+        # sharpest frame of each of min_count equal stretches of the clip
+        for members in np.array_split(np.arange(len(gray_frames)), min_count):
+            best = int(members[np.argmax(sharpness[members])])
+            if len(selected) < min_count and best not in selected:
+                selected.append(best)
+    return sorted(selected)
+
+def find_keyframe_indices(video_path: str, video_fps: float, max_frames: int, sampling: str) -> list[int]:
+    """Scores candidate frames at KEYFRAME_CANDIDATE_FPS and returns the video frame indices to keep."""
+    candidate_interval = max(1, int(video_fps / KEYFRAME_CANDIDATE_FPS))
+    vs = cv2.VideoCapture(video_path)
+    try:
+        candidate_indices, gray_frames = [], []
+        for index, frame in sample_video_frames(vs, candidate_interval, sampling):
+            height, width = frame.shape[:2]
+            small = cv2.resize(frame, (KEYFRAME_ANALYSIS_WIDTH, max(1, round(height * KEYFRAME_ANALYSIS_WIDTH / width))), interpolation=cv2.INTER_AREA)
+            gray_frames.append(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+            candidate_indices.append(index)
+    finally:
+        vs.release()
+
+    selected = select_keyframes(gray_frames, max_frames)
+    print(f"Selected {len(selected)} keyframes from {len(candidate_indices)} candidates")
+    return [candidate_indices[i] for i in selected]
+
+def iter_video_frames(video_path: str, fps: float = 3.0, output_dir: str | None = None, sampling: str = FRAME_SAMPLING, selection: str = KEYFRAME_SELECTION, max_frames: int | None = None):
+    """
+    Yields at most max_frames (default and upper limit MAX_FRAMES) sampled frames of a video as RGB uint8
+    arrays. Frames are only written to disk (as PNGs in output_dir) when a debug dump is requested.
+
+    With selection="fixed" frames are taken at a constant rate: the requested fps, lowered
+    when the clip is long enough that it would exceed max_frames. With "adaptive" a first
+    pass scores candidates and only the keyframes chosen by select_keyframes are decoded.
+    """
+    # MAX_FRAMES is the device's memory budget, so a per-job value may only lower it
+    max_frames = max(MIN_FRAMES, min(max_frames or MAX_FRAMES, MAX_FRAMES))
     print(f"Extracting frames from video: {video_path}")
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video file not found at {video_path}")
+    if sampling not in FRAME_SAMPLING_MODES:
+        raise ValueError(f"Unknown frame sampling mode: {sampling}")
+    if selection not in KEYFRAME_SELECTION_MODES:
+        raise ValueError(f"Unknown keyframe selection mode: {selection}")
     
     vs = cv2.VideoCapture(video_path)
     video_fps = vs.get(cv2.CAP_PROP_FPS)
     if video_fps == 0:
+        vs.release()
         raise ValueError("Could not get video FPS. The video file may be corrupt or invalid.")
-    frame_interval = int(video_fps * (1.0 / fps))
+    frame_interval = max(1, int(video_fps * (1.0 / fps)))
+    frame_count = int(vs.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frame_count > 0:
+        # Spread the frame budget over the whole clip instead of truncating its end
+        frame_interval = max(frame_interval, math.ceil(frame_count / max_frames))
+        print(f"Sampling at {video_fps / frame_interval:.2f} fps (requested {fps}, budget {max_frames} frames)")
+    frame_indices = None
+    if selection == "adaptive":
+        frame_indices = find_keyframe_indices(video_path, video_fps, max_frames, sampling)
     
-    image_paths = []
-    count = 0
     frame_num = 0
     
-    while True:
-        gotit, frame = vs.read()
-        if not gotit:
-            break
-        
-        if count % frame_interval == 0:
-            image_path = os.path.join(output_dir, f"{frame_num:06d}.png")
-            cv2.imwrite(image_path, frame)
-            image_paths.append(image_path)
+    try:
+        for _, frame in sample_video_frames(vs, frame_interval, sampling, frame_indices):
+            if frame_num >= max_frames:
+                # Only reachable when the container does not report a frame count
+                break
+            if output_dir:
+                cv2.imwrite(os.path.join(output_dir, f"{frame_num:06d}.png"), frame)
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             frame_num += 1
-        count += 1
-    
-    vs.release()
-    print(f"Extracted {len(image_paths)} frames")
-    return sorted(image_paths)
+    finally:
+        vs.release()
+        print(f"Extracted {frame_num} frames")
 
-def run_model_inference(target_dir: str, model_instance) -> dict:
-    print(f"Processing images from {target_dir}")
-    if model_instance is None:
-        raise RuntimeError("VGGT model is not loaded.")
+def extract_frames_from_video(video_path: str, fps: float = 3.0, output_dir: str | None = None, sampling: str = FRAME_SAMPLING, selection: str = KEYFRAME_SELECTION, max_frames: int | None = None) -> list[np.ndarray]:
+    return list(iter_video_frames(video_path, fps, output_dir, sampling, selection, max_frames))
 
-    image_names = glob.glob(os.path.join(target_dir, "*"))
-    image_names = sorted(image_names)
-    print(f"Found {len(image_names)} images for inference.")
-    
-    if len(image_names) == 0:
-        raise ValueError("No images found to process.")
+def preprocess_frames(frames, target_size: int = 518) -> torch.Tensor:
+    """
+    Converts RGB frames into the VGGT input tensor (N, 3, H, W) in [0, 1], matching
+    vggt's load_and_preprocess_images "crop" mode without the PNG round-trip: resize to
+    target_size width with the height rounded to a multiple of 14, then center-crop the
+    height to target_size. Accepts any iterable, so frames can be consumed as they decode.
+    """
+    images = []
+    for frame in frames:
+        height, width = frame.shape[:2]
+        new_width = target_size
+        new_height = round(height * (new_width / width) / 14) * 14
+        resized = np.asarray(Image.fromarray(frame).resize((new_width, new_height), Image.Resampling.BICUBIC))
+        if new_height > target_size:
+            start_y = (new_height - target_size) // 2
+            resized = resized[start_y : start_y + target_size]
+        images.append(torch.from_numpy(np.ascontiguousarray(resized)).permute(2, 0, 1).float().div_(255.0))
+
+    if len(images) == 0:
+        raise ValueError("No frames found to process.")
+    # All frames of one video share a size, so no padding is needed before stacking
+    return torch.stack(images)
 
-    images = load_and_preprocess_images(image_names).to(device)
+def predict_frames(images: torch.Tensor, model_instance, cpu_autocast: str = CPU_AUTOCAST, to_host: bool = True) -> dict:
+    """
+    Runs one VGGT forward pass and returns predictions with per-frame leading dimensions, as
+    NumPy arrays, or as fp32 tensors left on the inference device when to_host is False.
+    """
+    host_images = images
+    images = images.to(device)
     print(f"Preprocessed images tensor shape: {images.shape}")
+    if COMPILE_MODEL and len(images) > 1:
+        torch._dynamo.mark_dynamic(images, 0)
 
     print("Running model inference...")
-    dtype = torch.bfloat16 if torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8 else torch.float16
-    
     with torch.no_grad():
-        with torch.cuda.amp.autocast(dtype=dtype):
+        with inference_autocast(model_instance, cpu_autocast):
             predictions = model_instance(images)
 
     print("Converting pose encoding...")
@@ -123,126 +582,807 @@ def run_model_inference(target_dir: str, model_instance) -> dict:
     predictions["extrinsic"] = extrinsic
     predictions["intrinsic"] = intrinsic
 
-    for key in predictions.keys():
-        if isinstance(predictions[key], torch.Tensor):
-            predictions[key] = predictions[key].cpu().numpy().squeeze(0)
-    
-    print("Computing world points from depth map...")
-    depth_map = predictions["depth"]
-    world_points = unproject_depth_map_to_point_map(depth_map, predictions["extrinsic"], predictions["intrinsic"])
-    predictions["world_points_from_depth"] = world_points
-
+    for key in list(predictions.keys()):
+        if not isinstance(predictions[key], torch.Tensor):
+            continue
+        if STRIP_UNUSED_HEADS and key not in MESH_PREDICTION_KEYS:
+            # Only what the mesher consumes is copied back to host memory
+            del predictions[key]
+            continue
+        # CPU autocast is not disabled inside the heads like CUDA autocast is, so outputs may be bf16
+        value = predictions[key].float().squeeze(0)
+        predictions[key] = value.cpu().numpy() if to_host else value
+    if STRIP_UNUSED_HEADS:
+        # The input frames are already in host memory; reuse them instead of copying the model's echo back
+        predictions["images"] = host_images.cpu().numpy() if to_host else images
     return predictions
 
-def predictions_to_obj(predictions: dict, obj_path: str, conf_thres: float = 50.0, poisson_depth: int = 8):
-    print(f"Creating OBJ mesh with Poisson reconstruction: {obj_path}")
-    
-    pred_world_points = predictions["world_points_from_depth"]
-    pred_world_points_conf = predictions.get("depth_conf", np.ones_like(pred_world_points[..., 0]))
-    images = predictions["images"]
-    
-    vertices_3d = pred_world_points.reshape(-1, 3)
-    colors_rgb = np.transpose(images, (0, 2, 3, 1))
-    colors_rgb = colors_rgb.reshape(-1, 3)
-    
-    confidence_flat = pred_world_points_conf.reshape(-1)
-    conf_threshold_val = np.percentile(confidence_flat, conf_thres)
-    valid_mask = confidence_flat >= conf_threshold_val
+def umeyama_alignment(source: np.ndarray, target: np.ndarray) -> tuple[float, np.ndarray, np.ndarray]:
+    """Least-squares similarity transform (scale, R, t) with target ~= scale * R @ source + t."""
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    source_centered, target_centered = source - source_mean, target - target_mean
+    covariance = target_centered.T @ source_centered / len(source)
+    U, D, Vt = np.linalg.svd(covariance)
+    S = np.eye(3)
+    if np.linalg.det(U) * np.linalg.det(Vt) < 0:
+        S[2, 2] = -1
+    rotation = U @ S @ Vt
+    scale = np.trace(np.diag(D) @ S) / (source_centered**2).sum(axis=1).mean()
+    translation = target_mean - scale * rotation @ source_mean
+    return scale, rotation, translation
+
+def align_window(merged: dict, window: dict, overlap: int) -> tuple[float, np.ndarray, np.ndarray]:
+    """
+    Estimates the similarity transform from a window's coordinate frame into the merged one.
+    The window's first `overlap` frames are the merged sequence's last ones, so the same pixel
+    of the same frame unprojected in both gives a dense set of 3D correspondences.
+    """
+    merged_points = unproject_depth_map_to_point_map(
+        merged["depth"][-overlap:], merged["extrinsic"][-overlap:], merged["intrinsic"][-overlap:]
+    ).reshape(-1, 3)
+    window_points = unproject_depth_map_to_point_map(
+        window["depth"][:overlap], window["extrinsic"][:overlap], window["intrinsic"][:overlap]
+    ).reshape(-1, 3)
+    merged_conf = merged["depth_conf"][-overlap:].reshape(-1)
+    window_conf = window["depth_conf"][:overlap].reshape(-1)
+
+    valid = (
+        np.isfinite(merged_points).all(axis=1)
+        & np.isfinite(window_points).all(axis=1)
+        & (merged_conf >= np.median(merged_conf))
+        & (window_conf >= np.median(window_conf))
+    )
+    indices = np.flatnonzero(valid)
+    if len(indices) < 3:
+        raise ValueError("Not enough confident overlap to align inference windows.")
+    if len(indices) > ALIGNMENT_MAX_POINTS:
+        indices = np.random.default_rng(0).choice(indices, ALIGNMENT_MAX_POINTS, replace=False)
+    source, target = window_points[indices], merged_points[indices]
+
+    # Fit, drop the worst 20% of residuals (occlusion edges, depth noise), then refit
+    scale, rotation, translation = umeyama_alignment(source, target)
+    residuals = np.linalg.norm(scale * source @ rotation.T + translation - target, axis=1)
+    inliers = residuals <= np.quantile(residuals, 0.8)
+    return umeyama_alignment(source[inliers], target[inliers])
+
+def transform_window(window: dict, scale: float, rotation: np.ndarray, translation: np.ndarray):
+    """Moves a window's cameras, depths and point maps into the merged coordinate frame in place."""
+    # With X_merged = s * R @ X_window + t, a camera X_cam = R_c @ X_window + t_c becomes
+    # s * X_cam = (R_c @ R.T) @ X_merged + (s * t_c - R_c @ R.T @ t), i.e. depths scale by s.
+    cam_rotation = window["extrinsic"][:, :, :3] @ rotation.T
+    cam_translation = scale * window["extrinsic"][:, :, 3] - cam_rotation @ translation
+    window["extrinsic"] = np.concatenate([cam_rotation, cam_translation[..., None]], axis=-1).astype(np.float32)
+    window["depth"] = window["depth"] * scale
+    if "world_points" in window:
+        window["world_points"] = (scale * window["world_points"] @ rotation.T + translation).astype(np.float32)
+
+def run_windowed_inference(images: torch.Tensor, model_instance, window_size: int, overlap: int) -> dict:
+    """
+    Runs VGGT over overlapping windows of at most window_size frames and chains each window
+    onto the previous ones with a similarity transform estimated from the shared frames, so
+    peak memory depends on the window size rather than on the sequence length.
+    """
+    frame_count = len(images)
+    step = max(1, window_size - overlap)
+    starts = list(range(0, frame_count - overlap, step))
+    # Keep the last window full-sized; it then simply overlaps its predecessor more
+    starts[-1] = max(0, min(starts[-1], frame_count - window_size))
+    print(f"Running windowed inference: {len(starts)} windows of up to {window_size} frames")
+
+    merged = None
+    merged_end = 0
+    for start in starts:
+        end = min(start + window_size, frame_count)
+        window = predict_frames(images[start:end], model_instance)
+        # pose_enc is relative to each window's first frame and is not meaningful once merged
+        window.pop("pose_enc", None)
+        if merged is None:
+            merged = window
+        else:
+            window_overlap = merged_end - start
+            transform_window(window, *align_window(merged, window, window_overlap))
+            for key in merged:
+                merged[key] = np.concatenate([merged[key], window[key][window_overlap:]], axis=0)
+        merged_end = end
+        release_memory()
+    return merged
+
+def run_model_inference(images: torch.Tensor, model_instance, to_host: bool = True) -> dict:
+    """
+    Predicts depth, confidence and cameras for all frames. Results stay on the inference
+    device when to_host is False, except for windowed inference, which aligns on the host.
+    """
+    print(f"Processing {len(images)} frames")
+    if model_instance is None:
+        raise RuntimeError("VGGT model is not loaded.")
+
+    if INFERENCE_WINDOW and len(images) > INFERENCE_WINDOW:
+        return run_windowed_inference(images, model_instance, INFERENCE_WINDOW, INFERENCE_WINDOW_OVERLAP)
+    return predict_frames(images, model_instance, to_host=to_host)
+
+def percentile_threshold(values, percentile: float, method: str = THRESHOLD_METHOD) -> float:
+    """
+    Returns the value at the given percentile (0-100) of a NumPy array or tensor, for use as an
+    inclusive lower bound. "exact" selects the k-th smallest value in linear time
+    (torch.kthvalue on CUDA, np.partition elsewhere, as CPU kthvalue is slower than NumPy);
+    "histogram" approximates it from a value histogram.
+    """
+    if isinstance(values, torch.Tensor) and not values.is_cuda:
+        values = values.float().numpy()
+    is_tensor = isinstance(values, torch.Tensor)
+    flat = values.reshape(-1)
+    count = flat.numel() if is_tensor else flat.size
+    k = min(max(1, math.ceil(percentile / 100.0 * count)), count)
+
+    if method == "exact":
+        if is_tensor:
+            return torch.kthvalue(flat.float(), k).values.item()
+        return float(np.partition(flat, k - 1)[k - 1])
+
+    if is_tensor:
+        flat = flat.float()
+        low, high = flat.min().item(), flat.max().item()
+        counts = torch.histc(flat, bins=THRESHOLD_HISTOGRAM_BINS, min=low, max=high).cpu().numpy()
+    else:
+        low, high = float(flat.min()), float(flat.max())
+        counts, _ = np.histogram(flat, bins=THRESHOLD_HISTOGRAM_BINS, range=(low, high))
+    if high <= low:
+        return low
+    bin_index = int(np.searchsorted(np.cumsum(counts), k))
+    return low + (high - low) * bin_index / THRESHOLD_HISTOGRAM_BINS
+
+def predictions_to_points(predictions: dict, conf_thres: float = 50.0) -> dict:
+    """
+    Unprojects the depth maps into world-space colored points, keeping only pixels at or above
+    the conf_thres percentile of depth confidence, along with the direction from each point to
+    the camera that observed it. Runs as one batched PyTorch pass wherever the
+    predictions live (host arrays or device tensors), unprojecting only the surviving pixels, so
+    only the filtered point cloud is copied back to host memory.
+    """
+    as_tensor = lambda value: value if isinstance(value, torch.Tensor) else torch.from_numpy(np.asarray(value))
+    depth = as_tensor(predictions["depth"]).float()
+    frame_count, height, width = depth.shape[:3]
+    depth = depth.reshape(frame_count, height, width)
+    if "depth_conf" in predictions:
+        confidence = as_tensor(predictions["depth_conf"]).float().reshape(frame_count, height, width)
+    else:
+        confidence = torch.ones_like(depth)
+    extrinsic = as_tensor(predictions["extrinsic"]).float().to(depth.device)
+    intrinsic = as_tensor(predictions["intrinsic"]).float().to(depth.device)
+    images = as_tensor(predictions["images"]).to(depth.device)
+
+    print("Filtering and unprojecting confident depth pixels...")
+    threshold = percentile_threshold(confidence, conf_thres)
+    frame, row, column = torch.nonzero(confidence >= threshold, as_tuple=True)
+
+    # Pixel -> camera coordinates, then camera -> world with the inverse of the cam-from-world extrinsic
+    point_depth = depth[frame, row, column]
+    camera_points = torch.stack(
+        [
+            (column.float() - intrinsic[frame, 0, 2]) / intrinsic[frame, 0, 0] * point_depth,
+            (row.float() - intrinsic[frame, 1, 2]) / intrinsic[frame, 1, 1] * point_depth,
+            point_depth,
+        ],
+        dim=-1,
+    )
+    rotation, translation = extrinsic[frame, :, :3], extrinsic[frame, :, 3]
+    world_points = torch.einsum("nji,nj->ni", rotation, camera_points - translation)
+    colors = images[frame, :, row, column].float()
+    if images.dtype == torch.uint8:
+        # Cached predictions keep 8-bit colors; only the surviving points are scaled
+        colors /= 255.0
+    # Camera centers are -R^T t; the points' depth is already the distance along the view ray
+    camera_centers = -torch.einsum("fji,fj->fi", extrinsic[:, :, :3], extrinsic[:, :, 3])
+    view_directions = camera_centers[frame] - world_points
+
+    return {
+        "points": world_points.cpu().numpy(),
+        "colors": colors.cpu().numpy(),
+        "view_directions": view_directions.cpu().numpy(),
+    }
+
+def predictions_to_obj(predictions: dict, obj_path: str, conf_thres: float = 50.0, poisson_depth: int | str = 8):
+    points_to_obj(predictions_to_points(predictions, conf_thres), obj_path, poisson_depth)
+
+def export_mesh(mesh, mesh_path: str, quantize: bool = False):
+    """Writes a colored mesh in the format given by the path's extension (.obj, .ply or .glb)."""
+    if len(mesh.vertices) == 0 or len(mesh.triangles) == 0:
+        raise ValueError("Reconstruction produced an empty mesh; try a lower conf_thres or another mesher.")
+    print(f"Exporting mesh: {mesh_path}")
+    extension = os.path.splitext(mesh_path)[1]
+    if not mesh.has_vertex_normals():
+        mesh.compute_vertex_normals()
+    if extension == ".glb":
+        write_glb(
+            mesh_path,
+            np.asarray(mesh.vertices),
+            np.asarray(mesh.triangles),
+            colors=np.asarray(mesh.vertex_colors) if mesh.has_vertex_colors() else None,
+            normals=np.asarray(mesh.vertex_normals),
+            quantize=quantize,
+        )
+    elif extension == ".ply":
+        o3d.io.write_triangle_mesh(mesh_path, mesh, write_ascii=False, compressed=False, write_vertex_colors=True)
+    else:
+        o3d.io.write_triangle_mesh(mesh_path, mesh, write_vertex_colors=True)
+    print(f"Mesh created. Vertices: {len(mesh.vertices)}, Triangles: {len(mesh.triangles)}")
+
+def predictions_to_tsdf_obj(
+    predictions: dict, obj_path: str, conf_thres: float = 50.0, voxel_size: float | str = VOXEL_SIZE, quantize: bool = False
+):
+    """Fuses the confident pixels of every depth map into a TSDF volume and exports its surface."""
+    print(f"Creating mesh with TSDF fusion: {obj_path}")
+    depth = np.asarray(predictions["depth"], dtype=np.float32)
+    frame_count, height, width = depth.shape[:3]
+    depth = depth.reshape(frame_count, height, width)
+    confidence = np.asarray(predictions["depth_conf"]).reshape(frame_count, height, width)
+    threshold = percentile_threshold(confidence, conf_thres)
+
+    if voxel_size == "auto":
+        # The scene extent only needs a coarse look at the depth maps
+        stride = 8
+        sample = {
+            "depth": depth[:, ::stride, ::stride],
+            "depth_conf": confidence[:, ::stride, ::stride],
+            "extrinsic": predictions["extrinsic"],
+            "intrinsic": np.asarray(predictions["intrinsic"], dtype=np.float32) * np.array([[1 / stride], [1 / stride], [1]], dtype=np.float32),
+            "images": predictions["images"][:, :, ::stride, ::stride],
+        }
+        voxel_size = resolve_voxel_size(predictions_to_points(sample, conf_thres)["points"])
+    voxel_size = float(voxel_size)
+    if voxel_size <= 0:
+        raise ValueError("TSDF meshing needs a positive voxel size.")
+
+    volume = o3d.pipelines.integration.ScalableTSDFVolume(
+        voxel_length=voxel_size,
+        sdf_trunc=TSDF_TRUNCATION_VOXELS * voxel_size,
+        color_type=o3d.pipelines.integration.TSDFVolumeColorType.RGB8,
+    )
+    depth_trunc = float(depth.max()) + 1.0
+    print(f"Integrating {frame_count} depth maps (voxel size {voxel_size:.4f})...")
+    for index in range(frame_count):
+        # Zero depth marks a pixel as missing, which drops low-confidence pixels from the fusion
+        frame_depth = np.where(confidence[index] >= threshold, depth[index], 0).astype(np.float32)
+        color = np.transpose(predictions["images"][index], (1, 2, 0))
+        if color.dtype != np.uint8:
+            color = (color * 255).clip(0, 255).astype(np.uint8)
+        rgbd = o3d.geometry.RGBDImage.create_from_color_and_depth(
+            o3d.geometry.Image(np.ascontiguousarray(color)),
+            o3d.geometry.Image(frame_depth),
+            depth_scale=1.0,
+            depth_trunc=depth_trunc,
+            convert_rgb_to_intensity=False,
+        )
+        intrinsic = predictions["intrinsic"][index]
+        camera = o3d.camera.PinholeCameraIntrinsic(
+            width, height, float(intrinsic[0, 0]), float(intrinsic[1, 1]), float(intrinsic[0, 2]), float(intrinsic[1, 2])
+        )
+        extrinsic = np.eye(4)
+        extrinsic[:3, :4] = predictions["extrinsic"][index]
+        volume.integrate(rgbd, camera, extrinsic)
+
+    print("Extracting surface with marching cubes...")
+    mesh = volume.extract_triangle_mesh()
+    export_mesh(mesh, obj_path, quantize)
+
+def write_points_ply(point_cloud: dict, ply_path: str):
+    """Writes a colored point cloud as binary little-endian PLY straight from the NumPy arrays."""
+    points, colors = point_cloud["points"], point_cloud["colors"]
+    vertices = np.empty(
+        len(points),
+        dtype=[("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")],
+    )
+    for axis, name in enumerate(("x", "y", "z")):
+        vertices[name] = points[:, axis]
+    for axis, name in enumerate(("red", "green", "blue")):
+        vertices[name] = np.clip(colors[:, axis] * 255 + 0.5, 0, 255)
+    header = (
+        "ply\nformat binary_little_endian 1.0\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+        "end_header\n"
+    )
+    with open(ply_path, "wb") as f:
+        f.write(header.encode("ascii"))
+        vertices.tofile(f)
+
+def points_to_ply(point_cloud: dict, ply_path: str, voxel_size: float | str = VOXEL_SIZE):
+    print(f"Creating point cloud PLY: {ply_path}")
+    voxel_size = resolve_voxel_size(point_cloud["points"], voxel_size)
+    if voxel_size > 0 and len(point_cloud["points"]):
+        # Same voxel grid as the meshing path, so the preview matches the mesh's input points
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(point_cloud["points"])
+        pcd.colors = o3d.utility.Vector3dVector(point_cloud["colors"])
+        pcd = pcd.voxel_down_sample(voxel_size)
+        point_cloud = {"points": np.asarray(pcd.points), "colors": np.asarray(pcd.colors)}
+    write_points_ply(point_cloud, ply_path)
+    print(f"PLY point cloud created. Points: {len(point_cloud['points'])}")
+
+def resolve_voxel_size(points: np.ndarray, voxel_size: float | str = VOXEL_SIZE) -> float:
+    """Returns the downsampling voxel size, deriving it from the scene extent when set to "auto"."""
+    if voxel_size != "auto":
+        return float(voxel_size)
+    if len(points) == 0:
+        return 0.0
+    extent = points.max(axis=0) - points.min(axis=0)
+    return float(np.linalg.norm(extent)) / VOXEL_GRID_RESOLUTION
+
+def point_spacing(pcd) -> float:
+    """
+    Median nearest-neighbour distance of the cloud. Distances are measured from a sample of
+    points to their neighbours in the full cloud; neighbours within the sample alone would be
+    spread further apart by the sampling itself.
+    """
+    points = np.asarray(pcd.points)
+    sample = points
+    if len(points) > POISSON_SPACING_SAMPLES:
+        sample = points[np.random.default_rng(0).choice(len(points), POISSON_SPACING_SAMPLES, replace=False)]
+    tree = o3d.geometry.KDTreeFlann(pcd)
+    # The first of the two neighbours is the query point itself
+    squared_distances = [tree.search_knn_vector_3d(point, 2)[2][-1] for point in sample]
+    return float(np.sqrt(np.median(squared_distances)))
+
+def choose_poisson_depth(pcd, voxel_size: float = 0.0) -> tuple[int, bool]:
+    """
+    Picks the Poisson octree depth at which cells are about as wide as the point spacing,
+    clamped to [POISSON_MIN_DEPTH, POISSON_MAX_DEPTH]. After voxel downsampling the spacing is
+    the voxel size. Also returns whether to use linear_fit, which places vertices more
+    accurately when the budget forces cells coarser than the points.
+    """
+    points = np.asarray(pcd.points)
+    if len(points) < 2:
+        return POISSON_MIN_DEPTH, False
+    spacing = voxel_size if voxel_size > 0 else point_spacing(pcd)
+    cube_width = float((points.max(axis=0) - points.min(axis=0)).max()) * POISSON_SCALE
+    if spacing <= 0 or cube_width <= 0:
+        return POISSON_MIN_DEPTH, False
+    depth = math.ceil(math.log2(cube_width / spacing))
+    return min(max(depth, POISSON_MIN_DEPTH), POISSON_MAX_DEPTH), depth > POISSON_MAX_DEPTH
+
+def points_to_obj(
+    point_cloud: dict, obj_path: str, poisson_depth: int | str = 8, voxel_size: float | str = VOXEL_SIZE, quantize: bool = False
+):
+    print(f"Creating mesh with Poisson reconstruction: {obj_path}")
     
-    filtered_vertices = vertices_3d[valid_mask]
-    filtered_colors = colors_rgb[valid_mask]
+    filtered_vertices = point_cloud["points"]
+    filtered_colors = point_cloud["colors"]
     
     print(f"Creating point cloud with {len(filtered_vertices)} points...")
     pcd = o3d.geometry.PointCloud()
     pcd.points = o3d.utility.Vector3dVector(filtered_vertices)
     pcd.colors = o3d.utility.Vector3dVector(filtered_colors)
+    # Carried as normals so voxel downsampling averages them along with positions and colors
+    pcd.normals = o3d.utility.Vector3dVector(point_cloud["view_directions"])
+
+    voxel_size = resolve_voxel_size(filtered_vertices, voxel_size)
+    if voxel_size > 0:
+        pcd = pcd.voxel_down_sample(voxel_size)
+        print(f"Downsampled to {len(pcd.points)} points (voxel size {voxel_size:.4f})")
     
     print("Estimating normals...")
-    pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.05, max_nn=20))
-    pcd.orient_normals_consistent_tangent_plane(k=15)
+    # Keep a few voxels inside the search radius so coarse grids still have neighbours to fit
+    radius = max(NORMAL_RADIUS, 3 * voxel_size)
+    view_directions = np.asarray(pcd.normals).copy()
+    pcd.estimate_normals(search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=radius, max_nn=20))
+    # Every point was seen from the front, so flip normals that face away from their camera
+    normals = np.asarray(pcd.normals)
+    facing_away = np.einsum("ij,ij->i", normals, view_directions) < 0
+    normals[facing_away] *= -1
+    pcd.normals = o3d.utility.Vector3dVector(normals)
     
-    print(f"Running Poisson surface reconstruction (depth={poisson_depth})...")
-    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(pcd, depth=poisson_depth)
+    linear_fit = False
+    if poisson_depth == "auto":
+        poisson_depth, linear_fit = choose_poisson_depth(pcd, voxel_size)
+    elif poisson_depth > POISSON_MAX_DEPTH:
+        print(f"Requested Poisson depth {poisson_depth} exceeds the budget; using {POISSON_MAX_DEPTH}")
+        poisson_depth = POISSON_MAX_DEPTH
+    print(f"Running Poisson surface reconstruction (depth={poisson_depth}, linear_fit={linear_fit})...")
+    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
+        pcd, depth=poisson_depth, scale=POISSON_SCALE, linear_fit=linear_fit
+    )
     
     print("Cleaning mesh...")
-    vertices_to_remove = densities < np.quantile(densities, 0.01)
+    densities = np.asarray(densities)
+    vertices_to_remove = densities < percentile_threshold(densities, 1.0)
     mesh.remove_vertices_by_mask(vertices_to_remove)
     
-    print(f"Exporting to OBJ: {obj_path}")
-    o3d.io.write_triangle_mesh(obj_path, mesh, write_vertex_colors=True)
-    print(f"OBJ mesh created. Vertices: {len(mesh.vertices)}, Triangles: {len(mesh.triangles)}")
+    export_mesh(mesh, obj_path, quantize)
+
+def release_memory():
+    """Frees Python and CUDA allocator memory between jobs."""
+    gc.collect()
+    torch.cuda.empty_cache()
 
-async def notify_orchestrator(webhook_url: str, job_id: str, result_path: str):
-    """Notifies the main app that the conversion is complete."""
+# --- Prediction Cache ---
+# Stored dtype of each cached prediction. Confidences only drive a percentile threshold, so
+# float16 is plenty; images are stored as 8-bit colors.
+CACHED_PREDICTION_DTYPES = {
+    "depth": np.float32,
+    "depth_conf": np.float16,
+    "extrinsic": np.float32,
+    "intrinsic": np.float32,
+    "images": np.uint8,
+}
+
+def save_predictions(predictions: dict, job_id: str):
+    """
+    Writes the predictions needed for meshing as one uncompressed .npy file per key, which
+    load_predictions can memory-map. The cache directory appears atomically once complete.
+    """
+    job_dir = os.path.join(PREDICTIONS_DIR, job_id)
+    partial_dir = f"{job_dir}.partial"
+    os.makedirs(partial_dir, exist_ok=True)
+    for key, dtype in CACHED_PREDICTION_DTYPES.items():
+        value = predictions[key]
+        if key == "images":
+            value = np.clip(value * 255.0 + 0.5, 0, 255)
+        np.save(os.path.join(partial_dir, f"{key}.npy"), np.ascontiguousarray(value, dtype=dtype))
+    shutil.rmtree(job_dir, ignore_errors=True)
+    os.replace(partial_dir, job_dir)
+    print(f"Cached predictions for job {job_id}")
+    evict_cached_predictions()
+
+def load_predictions(job_id: str) -> dict:
+    """Memory-maps a job's cached predictions. Images stay 8-bit; consumers scale the colors they use."""
+    job_dir = os.path.join(PREDICTIONS_DIR, job_id)
+    if not os.path.isdir(job_dir):
+        raise FileNotFoundError(f"No cached predictions for job {job_id}")
+    predictions = {
+        key: np.load(os.path.join(job_dir, f"{key}.npy"), mmap_mode="r")
+        for key in CACHED_PREDICTION_DTYPES
+    }
+    # Mark the cache as recently used so eviction keeps it
+    os.utime(job_dir)
+    return predictions
+
+def evict_cached_predictions():
+    """Deletes the least recently used prediction caches beyond PREDICTIONS_CACHE_MAX_JOBS."""
+    entries = [
+        entry for entry in os.scandir(PREDICTIONS_DIR)
+        if entry.is_dir() and not entry.name.endswith(".partial")
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[PREDICTIONS_CACHE_MAX_JOBS:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        print(f"Evicted cached predictions: {entry.name}")
+
+async def notify_orchestrator(
+    webhook_url: str, job_id: str, result_path: str | None = None, error: str | None = None, preview_path: str | None = None
+):
+    """Notifies the main app that the conversion is complete, that it failed, or that a preview is ready."""
     print(f"Sending result for {job_id} to webhook: {webhook_url}")
     try:
         async with httpx.AsyncClient(timeout=60) as client:
             payload = {"job_id": job_id, "result_path": result_path}
+            if error:
+                payload["error"] = error
+            if preview_path:
+                payload["preview_path"] = preview_path
             response = await client.post(webhook_url, json=payload)
             response.raise_for_status()
             print(f"Successfully sent webhook for {job_id}")
-    except httpx.RequestError as e:
+    except httpx.HTTPError as e:
         print(f"Failed to send webhook for {job_id}: {e}")
 
-# --- Background Task for Conversion and Webhook ---
-async def process_and_notify(job_id: str, video_path: str, webhook_url: str):
+# --- Stage Pipeline ---
+class PipelineOptions(BaseModel):
+    """Per-job pipeline settings sent by the orchestrator; unset fields use the worker defaults."""
+    fps: float = Field(2.0, gt=0)
+    max_frames: int | None = Field(None, ge=MIN_FRAMES, le=MAX_FRAMES)
+    keyframe_selection: Literal["fixed", "adaptive"] = KEYFRAME_SELECTION
+    conf_thres: float = Field(50.0, ge=0, lt=100)
+    poisson_depth: Annotated[int, Field(ge=1, le=POISSON_MAX_DEPTH)] | Literal["auto"] = POISSON_DEPTH
+    # None uses the worker's VOXEL_SIZE; 0 disables downsampling
+    voxel_size: Annotated[float, Field(ge=0)] | Literal["auto"] | None = None
+    mesher: Literal["poisson", "tsdf"] = MESHER
+    output: Literal["mesh", "points"] = OUTPUT_MODE
+    # Publish the point cloud as a preview while the mesh is built
+    preview: bool = False
+    format: Literal["obj", "ply", "glb"] = RESULT_FORMAT
+    # Quantized positions, normals and colors for GLB results
+    quantize: bool = QUANTIZE_RESULTS
+
+    @property
+    def needs_point_cloud(self) -> bool:
+        return self.output == "points" or self.preview or self.mesher == "poisson"
+
+@dataclass
+class ConversionJob:
+    """State carried by one job as it moves through the pipeline stages."""
+    job_id: str
+    video_path: str
+    webhook_url: str
+    temp_dir: Path
+    result_path: str
+    options: PipelineOptions = field(default_factory=PipelineOptions)
+    # Set for re-mesh jobs, which start at the mesh stage from this job's cached predictions
+    source_job_id: str | None = None
+    images: torch.Tensor | None = None
+    # Host copies of the predictions, only kept until the mesh stage has cached them
+    predictions: dict | None = None
+    # Confidence-filtered world points and colors handed from inference to meshing
+    point_cloud: dict | None = None
+
+    @property
+    def images_dir(self) -> Path:
+        return self.temp_dir / "images"
+
+    @property
+    def preview_path(self) -> str:
+        return os.path.abspath(os.path.join(RESULTS_DIR, f"{self.job_id}.preview.ply"))
+
+def result_path_for(job_id: str, options: PipelineOptions) -> str:
+    """Where a job's result is written; the extension follows the output mode and format."""
+    extension = ".ply" if options.output == "points" else f".{options.format}"
+    return os.path.abspath(os.path.join(RESULTS_DIR, f"{job_id}{extension}"))
+
+class PipelineStage:
     """
-    Runs the full conversion pipeline from a local file path and notifies the orchestrator.
+    One pipeline stage: a bounded input queue, runner tasks that take jobs off it, and a
+    dedicated thread pool in which the stage's blocking handler runs. Finished jobs are
+    handed to the next stage, or completed when this is the last one.
     """
-    temp_processing_dir = Path(WORKER_TEMP_DIR) / job_id
-    images_dir = temp_processing_dir / "images"
-    os.makedirs(images_dir, exist_ok=True)
-    
-    result_obj_path = os.path.abspath(os.path.join(RESULTS_DIR, f"{job_id}.obj"))
-    
+
+    def __init__(self, name: str, handler, workers: int, queue_size: int):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue: asyncio.Queue | None = None
+        self.next_stage: "PipelineStage | None" = None
+        self.executor: ThreadPoolExecutor | None = None
+        self.runners: list[asyncio.Task] = []
+        # Event loop the runners live on, for handlers that need to schedule notifications
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.running = 0
+        # Exponential moving average of the handler's duration, used for Retry-After
+        self.average_seconds = DEFAULT_STAGE_SECONDS
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        self.runners = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    def stop(self):
+        for runner in self.runners:
+            runner.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            ACTIVE_JOBS[job.job_id] = self.name
+            self.running += 1
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(self.executor, self.handler, job)
+            except Exception as e:
+                await fail_job(job, f"{self.name} stage failed: {e}")
+                continue
+            finally:
+                self.running -= 1
+                self.average_seconds = 0.8 * self.average_seconds + 0.2 * (time.monotonic() - started)
+                self.queue.task_done()
+
+            if self.next_stage:
+                ACTIVE_JOBS[job.job_id] = f"waiting for {self.next_stage.name}"
+                # Blocks while the next stage is saturated, propagating backpressure upstream
+                await self.next_stage.queue.put(job)
+            else:
+                await complete_job(job)
+
+    def status(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.queue.qsize() if self.queue else 0,
+            "average_seconds": round(self.average_seconds, 1),
+        }
+
+def extract_stage(job: ConversionJob):
+    dump_dir = None
+    if DEBUG_DUMP_FRAMES:
+        dump_dir = str(job.images_dir)
+        os.makedirs(dump_dir, exist_ok=True)
+    frames = iter_video_frames(
+        job.video_path,
+        fps=job.options.fps,
+        output_dir=dump_dir,
+        selection=job.options.keyframe_selection,
+        max_frames=job.options.max_frames,
+    )
+    job.images = preprocess_frames(frames)
+
+def predictions_to_host(predictions: dict) -> dict:
+    """Copies any prediction tensors still on the inference device into NumPy arrays."""
+    return {
+        key: value.cpu().numpy() if isinstance(value, torch.Tensor) else value
+        for key, value in predictions.items()
+    }
+
+def inference_stage(job: ConversionJob):
     try:
-        # 1. Extract frames from the local video file
-        extract_frames_from_video(video_path, str(images_dir), fps=2.0)
-
-        # 2. Run model inference
-        predictions = run_model_inference(str(images_dir), model)
-        
-        # 3. Create OBJ file in the shared results directory
-        predictions_to_obj(predictions, result_obj_path, conf_thres=50.0, poisson_depth=8)
-        
-        # 4. Clean up model-related resources
+        # Filtering and unprojection run on the device and only the surviving points are copied
+        # back; the raw predictions follow only when they are cached or needed for TSDF fusion
+        predictions = run_model_inference(job.images, model, to_host=False)
+        if job.options.needs_point_cloud:
+            job.point_cloud = predictions_to_points(predictions, job.options.conf_thres)
+        if CACHE_PREDICTIONS or job.options.mesher == "tsdf":
+            job.predictions = predictions_to_host(predictions)
         del predictions
-        gc.collect()
-        torch.cuda.empty_cache()
-
-        # 5. Notify the orchestrator that the job is complete
-        await notify_orchestrator(webhook_url, job_id, result_obj_path)
+    finally:
+        job.images = None
+        release_memory()
 
-    except Exception as e:
-        print(f"FATAL: Conversion pipeline failed for {job_id}: {e}")
-        # Optionally, notify orchestrator of failure
+def mesh_stage(job: ConversionJob):
+    try:
+        if job.source_job_id:
+            job.predictions = load_predictions(job.source_job_id)
+        elif CACHE_PREDICTIONS:
+            save_predictions(job.predictions, job.job_id)
+        voxel_size = VOXEL_SIZE if job.options.voxel_size is None else job.options.voxel_size
+        if job.point_cloud is None and job.options.needs_point_cloud:
+            job.point_cloud = predictions_to_points(job.predictions, job.options.conf_thres)
+        if job.options.output == "points":
+            points_to_ply(job.point_cloud, job.result_path, voxel_size)
+            return
+        if job.options.preview:
+            points_to_ply(job.point_cloud, job.preview_path, voxel_size)
+            # The mesh stage runs in a worker thread; hand the webhook to the event loop
+            asyncio.run_coroutine_threadsafe(
+                notify_orchestrator(job.webhook_url, job.job_id, preview_path=job.preview_path),
+                PIPELINE_STAGES[-1].loop,
+            )
+        if job.options.mesher == "tsdf":
+            predictions_to_tsdf_obj(job.predictions, job.result_path, job.options.conf_thres, voxel_size, job.options.quantize)
+            return
+        job.predictions = None
+        points_to_obj(
+            job.point_cloud,
+            job.result_path,
+            poisson_depth=job.options.poisson_depth,
+            voxel_size=voxel_size,
+            quantize=job.options.quantize,
+        )
     finally:
-        # 6. Clean up INTERMEDIATE files for this job (frames)
-        if temp_processing_dir.exists():
-            shutil.rmtree(temp_processing_dir)
-            print(f"Cleaned up intermediate files for job {job_id}")
-        
-        # 7. Clean up the original SOURCE video file
-        if os.path.exists(video_path):
-            os.remove(video_path)
-            print(f"Cleaned up source video for job {job_id}: {video_path}")
+        job.predictions = None
+        job.point_cloud = None
+        release_memory()
+
+def cleanup_job_files(job: ConversionJob):
+    """Removes a job's intermediate frames and its source video."""
+    if job.temp_dir.exists():
+        shutil.rmtree(job.temp_dir)
+        print(f"Cleaned up intermediate files for job {job.job_id}")
+
+    if os.path.exists(job.video_path):
+        os.remove(job.video_path)
+        print(f"Cleaned up source video for job {job.job_id}: {job.video_path}")
+
+async def complete_job(job: ConversionJob):
+    ACTIVE_JOBS.pop(job.job_id, None)
+    cleanup_job_files(job)
+    await notify_orchestrator(job.webhook_url, job.job_id, result_path=job.result_path)
+
+async def fail_job(job: ConversionJob, error: str):
+    print(f"FATAL: Conversion pipeline failed for {job.job_id}: {error}")
+    ACTIVE_JOBS.pop(job.job_id, None)
+    job.images = None
+    job.predictions = None
+    job.point_cloud = None
+    cleanup_job_files(job)
+    if os.path.exists(job.preview_path):
+        os.remove(job.preview_path)
+    await notify_orchestrator(job.webhook_url, job.job_id, error=error)
+
+PIPELINE_STAGES = [
+    PipelineStage("extract", extract_stage, EXTRACT_WORKERS, MAX_QUEUED_JOBS),
+    PipelineStage("inference", inference_stage, MAX_CONCURRENT_JOBS, STAGE_QUEUE_SIZE),
+    PipelineStage("mesh", mesh_stage, MESH_WORKERS, STAGE_QUEUE_SIZE),
+]
+for current_stage, following_stage in zip(PIPELINE_STAGES, PIPELINE_STAGES[1:]):
+    current_stage.next_stage = following_stage
+
+def estimate_retry_after() -> int:
+    """Seconds until the queue is likely to accept a job: one job time of the slowest stage."""
+    return max(1, math.ceil(max(stage.average_seconds / stage.workers for stage in PIPELINE_STAGES)))
 
 # --- Worker API Endpoint ---
+# Worker settings that change what a job produces for given options. The orchestrator keys its
+# result cache on this fingerprint, so changing any of them stops stale results being served.
+PIPELINE_CONFIG = {
+    "device": device,
+    "checkpoint": VGGT_CHECKPOINT,
+    "max_frames": MAX_FRAMES,
+    "keyframe": [KEYFRAME_CANDIDATE_FPS, KEYFRAME_ANALYSIS_WIDTH, KEYFRAME_MOTION_PERCENTILE, KEYFRAME_MIN_MOTION, KEYFRAME_MAX_SIMILARITY],
+    "inference_window": [INFERENCE_WINDOW, INFERENCE_WINDOW_OVERLAP, ALIGNMENT_MAX_POINTS],
+    "cpu_inference": [CPU_AUTOCAST, CPU_QUANTIZE],
+    "threshold": [THRESHOLD_METHOD, THRESHOLD_HISTOGRAM_BINS],
+    "voxel": [VOXEL_SIZE, VOXEL_GRID_RESOLUTION],
+    "tsdf_truncation_voxels": TSDF_TRUNCATION_VOXELS,
+    "poisson_depth_range": [POISSON_MIN_DEPTH, POISSON_MAX_DEPTH],
+}
+PIPELINE_CONFIG_VERSION = hashlib.sha256(json.dumps(PIPELINE_CONFIG, sort_keys=True).encode()).hexdigest()[:16]
+
+@app.post("/options")
+def normalize_options(options: PipelineOptions):
+    """Validates job options and returns them with the worker's defaults filled in, plus its config version."""
+    return {"options": options.model_dump(), "config_version": PIPELINE_CONFIG_VERSION}
+
 class ConversionRequest(BaseModel):
     job_id: str
     video_path: str
     webhook_url: str
+    options: PipelineOptions = Field(default_factory=PipelineOptions)
 
 @app.post("/convert")
-async def convert_video(request: ConversionRequest, background_tasks: BackgroundTasks):
-    if model is None:
+async def convert_video(request: ConversionRequest):
+    entry_stage = PIPELINE_STAGES[0]
+    if model is None or entry_stage.queue is None:
         raise HTTPException(status_code=503, detail="Model is not loaded. Worker is not ready.")
 
-    print(f"Worker received job: {request.job_id}. Starting conversion in background.")
-    
-    background_tasks.add_task(process_and_notify, request.job_id, request.video_path, request.webhook_url)
-    
-    return {"message": "Conversion task accepted and is running in the background."}
+    job = ConversionJob(
+        job_id=request.job_id,
+        video_path=request.video_path,
+        webhook_url=request.webhook_url,
+        temp_dir=Path(WORKER_TEMP_DIR) / request.job_id,
+        result_path=result_path_for(request.job_id, request.options),
+        options=request.options,
+    )
+    try:
+        entry_stage.queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Worker queue is full. Retry later.",
+            headers={"Retry-After": str(estimate_retry_after())},
+        )
+
+    ACTIVE_JOBS[request.job_id] = "queued"
+    print(f"Worker queued job: {request.job_id} ({entry_stage.queue.qsize()} waiting).")
+    return {"message": "Conversion task accepted and queued.", "queue_position": entry_stage.queue.qsize()}
+
+class RemeshRequest(BaseModel):
+    job_id: str
+    source_job_id: str
+    webhook_url: str
+    options: PipelineOptions = Field(default_factory=PipelineOptions)
+
+@app.post("/remesh")
+async def remesh_job(request: RemeshRequest):
+    """Builds a new mesh from an earlier job's cached predictions, skipping extraction and inference."""
+    stage = PIPELINE_STAGES[-1]
+    if stage.queue is None:
+        raise HTTPException(status_code=503, detail="Worker is not ready.")
+    if not os.path.isdir(os.path.join(PREDICTIONS_DIR, request.source_job_id)):
+        raise HTTPException(status_code=404, detail="No cached predictions for this job.")
+
+    job = ConversionJob(
+        job_id=request.job_id,
+        video_path="",
+        webhook_url=request.webhook_url,
+        temp_dir=Path(WORKER_TEMP_DIR) / request.job_id,
+        result_path=result_path_for(request.job_id, request.options),
+        options=request.options,
+        source_job_id=request.source_job_id,
+    )
+    try:
+        stage.queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Worker queue is full. Retry later.",
+            headers={"Retry-After": str(estimate_retry_after())},
+        )
+
+    ACTIVE_JOBS[request.job_id] = "queued"
+    print(f"Worker queued re-mesh job {request.job_id} from {request.source_job_id}.")
+    return {"message": "Re-mesh task accepted and queued."}
 
 # --- Health Check Endpoint ---
 @app.get("/")
@@ -250,5 +1390,9 @@ def health_check():
     return {
         "status": "Worker is alive",
         "model_loaded": model is not None,
-        "device": device
+        "model_load_seconds": round(model_load_seconds, 1) if model_load_seconds is not None else None,
+        "device": device,
+        "active_jobs": dict(ACTIVE_JOBS),
+        "queue_capacity": MAX_QUEUED_JOBS,
+        "stages": {stage.name: stage.status() for stage in PIPELINE_STAGES},
     }